@@ -1,4 +1,8 @@
 import chess
+import chess.polyglot
+import math
+import random
+import sys
 import time
 
 # Piece-square tables
@@ -173,87 +177,1123 @@ ENDGAME_OPP_KING_CORNERED_TABLE = [
 
 ]
 
-def is_endgame_position(board):
-    # Check if there are no major pieces
-    no_major_pieces = (
-        sum(1 for _ in board.pieces(chess.ROOK, chess.WHITE)) == 0 and
-        sum(1 for _ in board.pieces(chess.QUEEN, chess.WHITE)) == 0 and
-        sum(1 for _ in board.pieces(chess.ROOK, chess.BLACK)) == 0 and
-        sum(1 for _ in board.pieces(chess.QUEEN, chess.BLACK)) == 0
-    )
-    if no_major_pieces:
-        return True
-
-    # Check for two rooks and no queens
-    if sum(1 for _ in board.pieces(chess.ROOK, chess.WHITE)) <= 2 and sum(1 for _ in board.pieces(chess.QUEEN, chess.WHITE)) == 0 and sum(1 for _ in board.pieces(chess.QUEEN, chess.BLACK)) == 0:
-        return True
-    if sum(1 for _ in board.pieces(chess.ROOK, chess.BLACK)) <= 2 and sum(1 for _ in board.pieces(chess.QUEEN, chess.BLACK)) == 0 and sum(1 for _ in board.pieces(chess.QUEEN, chess.WHITE)) == 0:
-        return True
-
-    # Check for one queen and no rooks
-    if sum(1 for _ in board.pieces(chess.QUEEN, chess.WHITE)) == 1 and sum(1 for _ in board.pieces(chess.ROOK, chess.WHITE)) == 0 and sum(1 for _ in board.pieces(chess.ROOK, chess.BLACK)) == 0:
-        return True
-    if sum(1 for _ in board.pieces(chess.QUEEN, chess.BLACK)) == 1 and sum(1 for _ in board.pieces(chess.ROOK, chess.BLACK)) == 0 and sum(1 for _ in board.pieces(chess.ROOK, chess.BLACK)) == 0:
-        return True
+# Zobrist keys, laid out exactly like python-chess's polyglot hasher so the
+# incremental key can be checked against chess.polyglot.zobrist_hash
+ZOBRIST_PIECES = [
+    [
+        [chess.polyglot.POLYGLOT_RANDOM_ARRAY[64 * ((piece_type - 1) * 2 + color) + square] if piece_type else 0 for square in chess.SQUARES]
+        for piece_type in range(7)
+    ]
+    for color in (chess.BLACK, chess.WHITE)
+]
+ZOBRIST_CASTLING = [
+    (chess.BB_H1, chess.polyglot.POLYGLOT_RANDOM_ARRAY[768]),
+    (chess.BB_A1, chess.polyglot.POLYGLOT_RANDOM_ARRAY[769]),
+    (chess.BB_H8, chess.polyglot.POLYGLOT_RANDOM_ARRAY[770]),
+    (chess.BB_A8, chess.polyglot.POLYGLOT_RANDOM_ARRAY[771]),
+]
+ZOBRIST_EP = chess.polyglot.POLYGLOT_RANDOM_ARRAY[772:780]
+ZOBRIST_TURN = chess.polyglot.POLYGLOT_RANDOM_ARRAY[780]
+
+# Squares a pawn of the side to move must stand on to capture en passant on a given square
+EP_ATTACKERS = [[0] * 64 for _ in chess.COLORS]
+for _square in chess.SQUARES:
+    _bb = chess.BB_SQUARES[_square]
+    EP_ATTACKERS[chess.WHITE][_square] = chess.shift_left(chess.shift_down(_bb)) | chess.shift_right(chess.shift_down(_bb))
+    EP_ATTACKERS[chess.BLACK][_square] = chess.shift_left(chess.shift_up(_bb)) | chess.shift_right(chess.shift_up(_bb))
+
+# Set to True to compare the incremental key with a full recompute after every push/pop
+ZOBRIST_SELF_CHECK = False
+
+def pawn_zobrist_hash(board):
+    # The pawn-only part of the key, which indexes the pawn hash table
+    key = 0
+    for color in chess.COLORS:
+        for square in chess.scan_forward(board.pawns & board.occupied_co[color]):
+            key ^= ZOBRIST_PIECES[color][chess.PAWN][square]
+    return key
+
+# Attack tables
+# Knight, king and pawn attacks by square, and slider attacks looked up by the
+# blocker occupancy: ROOK_ATTACKS[square] maps occupied & ROOK_MASKS[square]
+# (the squares on the lines through square, edges left out) to the attacked
+# squares. This is the fancy-magic layout, with the dict doing the hashing that
+# the magic multiply does in C; a multiply and shift on Python ints is no faster
+# than hashing the masked occupancy directly.
+def slide(square, occupied, directions):
+    attacks = 0
+    for file_step, rank_step in directions:
+        file, rank = square & 7, square >> 3
+        while True:
+            file += file_step
+            rank += rank_step
+            if not (0 <= file < 8 and 0 <= rank < 8):
+                break
+            attacks |= 1 << (rank * 8 + file)
+            if occupied & (1 << (rank * 8 + file)):
+                break
+    return attacks
+
+def step_attacks(square, steps):
+    return slide(square, chess.BB_ALL, steps)
+
+def line_attack_table(square, directions):
+    # Blocker mask and occupancy -> attacks table for one line through square
+    mask = 0
+    for direction in directions:
+        ray = slide(square, 0, [direction])
+        if ray:
+            mask |= ray & ~(1 << chess.msb(ray) if direction[0] + 8 * direction[1] > 0 else 1 << chess.lsb(ray))
+    table = {}
+    subset = 0
+    while True:
+        # Carry-rippler walk over every subset of the mask
+        table[subset] = slide(square, subset, directions)
+        subset = (subset - mask) & mask
+        if not subset:
+            break
+    return mask, table
 
-    # Check for two queens, kings, and no other pieces
+def slider_attack_tables(line_directions):
+    masks = []
+    tables = []
+    for square in chess.SQUARES:
+        (first_mask, first_table), (second_mask, second_table) = [line_attack_table(square, directions) for directions in line_directions]
+        masks.append(first_mask | second_mask)
+        tables.append({first_occupied | second_occupied: first_attacks | second_attacks
+                       for first_occupied, first_attacks in first_table.items()
+                       for second_occupied, second_attacks in second_table.items()})
+    return masks, tables
+
+KNIGHT_ATTACKS = [step_attacks(square, [(1, 2), (2, 1), (2, -1), (1, -2), (-1, -2), (-2, -1), (-2, 1), (-1, 2)]) for square in chess.SQUARES]
+KING_ATTACKS = [step_attacks(square, [(1, 0), (1, 1), (0, 1), (-1, 1), (-1, 0), (-1, -1), (0, -1), (1, -1)]) for square in chess.SQUARES]
+PAWN_ATTACKS = [
+    [step_attacks(square, [(-1, -1), (1, -1)]) for square in chess.SQUARES],  # black
+    [step_attacks(square, [(-1, 1), (1, 1)]) for square in chess.SQUARES],  # white
+]
+ROOK_MASKS, ROOK_ATTACKS = slider_attack_tables([[(1, 0), (-1, 0)], [(0, 1), (0, -1)]])
+BISHOP_MASKS, BISHOP_ATTACKS = slider_attack_tables([[(1, 1), (-1, -1)], [(1, -1), (-1, 1)]])
+
+def attackers_to(board, square, occupied):
+    # Pieces of both colours attacking square, with sliders seeing through
+    # everything not in occupied
+    rooks_and_queens = board.rooks | board.queens
+    bishops_and_queens = board.bishops | board.queens
+    return ((KNIGHT_ATTACKS[square] & board.knights)
+            | (KING_ATTACKS[square] & board.kings)
+            | (PAWN_ATTACKS[chess.WHITE][square] & board.pawns & board.occupied_co[chess.BLACK])
+            | (PAWN_ATTACKS[chess.BLACK][square] & board.pawns & board.occupied_co[chess.WHITE])
+            | (ROOK_ATTACKS[square][occupied & ROOK_MASKS[square]] & rooks_and_queens)
+            | (BISHOP_ATTACKS[square][occupied & BISHOP_MASKS[square]] & bishops_and_queens))
+
+# Material plus piece-square value of a piece on a square, signed from white's
+# point of view: PST_MIDDLEGAME[color][piece_type][square]
+PST_MIDDLEGAME = [[[0] * 64 for _ in range(7)] for _ in chess.COLORS]
+PST_ENDGAME = [[[0] * 64 for _ in range(7)] for _ in chess.COLORS]
+for _piece_type in chess.PIECE_TYPES:
+    for _square in chess.SQUARES:
+        PST_MIDDLEGAME[chess.WHITE][_piece_type][_square] = piece_values_middlegame[_piece_type] + piece_square_tables_middlegame[_piece_type][63 - _square]
+        PST_MIDDLEGAME[chess.BLACK][_piece_type][_square] = -piece_values_middlegame[_piece_type] - piece_square_tables_middlegame[_piece_type][_square]
+        PST_ENDGAME[chess.WHITE][_piece_type][_square] = piece_values_endgame[_piece_type] + piece_square_tables_endgame[_piece_type][63 - _square]
+        PST_ENDGAME[chess.BLACK][_piece_type][_square] = -piece_values_endgame[_piece_type] - piece_square_tables_endgame[_piece_type][_square]
+
+# Game phase, PeSTO style: 24 with all pieces on the board, 0 with only kings and pawns
+PHASE_WEIGHTS = [0, 0, 1, 1, 2, 4, 0]
+MAX_PHASE = 24
+
+def pst_scores(board):
+    # Full scan of the board, used to set up and to check the running totals
+    middlegame = endgame = phase = 0
+    for square, piece in board.piece_map().items():
+        middlegame += PST_MIDDLEGAME[piece.color][piece.piece_type][square]
+        endgame += PST_ENDGAME[piece.color][piece.piece_type][square]
+        phase += PHASE_WEIGHTS[piece.piece_type]
+    return middlegame, endgame, phase
+
+# Set to True to compare the running material, piece-square, phase and material signature totals with a full scan after every push/pop
+PST_SELF_CHECK = False
+
+# Material signature: the number of pieces of each colour and type (kings
+# excepted), 4 bits each, packed into one int. Everything that only depends on
+# the material on the board is computed once per signature and then looked up.
+MATERIAL_INCREMENT = [[0] * 7 for _ in chess.COLORS]
+for _color in chess.COLORS:
+    for _piece_type in (chess.PAWN, chess.KNIGHT, chess.BISHOP, chess.ROOK, chess.QUEEN):
+        MATERIAL_INCREMENT[_color][_piece_type] = 1 << (((_piece_type - 1) * 2 + _color) * 4)
+
+MATERIAL_ENDGAME = 1
+MATERIAL_DRAW = 2
+MATERIAL_ZUGZWANG_WHITE = 4
+MATERIAL_ZUGZWANG_BLACK = 8
+
+material_flags_cache = {}
+
+def material_key(board):
+    key = 0
+    for color in chess.COLORS:
+        for piece_type in (chess.PAWN, chess.KNIGHT, chess.BISHOP, chess.ROOK, chess.QUEEN):
+            key += board.pieces_mask(piece_type, color).bit_count() * MATERIAL_INCREMENT[color][piece_type]
+    return key
+
+def material_count(key, piece_type, color):
+    return key // MATERIAL_INCREMENT[color][piece_type] & 15
+
+def material_signature(white_pieces, black_pieces):
+    # Signature from piece letters, kings left out: material_signature("BN", "")
+    key = 0
+    for color, pieces in ((chess.WHITE, white_pieces), (chess.BLACK, black_pieces)):
+        for symbol in pieces:
+            key += MATERIAL_INCREMENT[color][chess.PIECE_SYMBOLS.index(symbol.lower())]
+    return key
+
+def compute_material_flags(key):
+    pawns = [material_count(key, chess.PAWN, color) for color in chess.COLORS[::-1]]
+    knights = [material_count(key, chess.KNIGHT, color) for color in chess.COLORS[::-1]]
+    bishops = [material_count(key, chess.BISHOP, color) for color in chess.COLORS[::-1]]
+    rooks = [material_count(key, chess.ROOK, color) for color in chess.COLORS[::-1]]
+    queens = [material_count(key, chess.QUEEN, color) for color in chess.COLORS[::-1]]
+    white, black = chess.WHITE, chess.BLACK
+    flags = 0
+
+    # No major pieces, rooks but no queens, or a single queen without rooks
     if (
-        sum(1 for _ in board.pieces(chess.QUEEN, chess.WHITE)) <= 1
-        and sum(1 for _ in board.pieces(chess.KING, chess.WHITE)) == 1
-        and sum(1 for _ in board.pieces(chess.KNIGHT, chess.WHITE)) == 0
-        and sum(1 for _ in board.pieces(chess.BISHOP, chess.WHITE)) == 0
-        and sum(1 for _ in board.pieces(chess.ROOK, chess.WHITE)) == 0
-        and sum(1 for _ in board.pieces(chess.PAWN, chess.WHITE)) == 0
-        and sum(1 for _ in board.pieces(chess.QUEEN, chess.BLACK)) <= 1
-        and sum(1 for _ in board.pieces(chess.KING, chess.BLACK)) == 1
-        and sum(1 for _ in board.pieces(chess.KNIGHT, chess.BLACK)) == 0
-        and sum(1 for _ in board.pieces(chess.BISHOP, chess.BLACK)) == 0
-        and sum(1 for _ in board.pieces(chess.ROOK, chess.BLACK)) == 0
-        and sum(1 for _ in board.pieces(chess.PAWN, chess.BLACK)) == 0
+        rooks[white] == 0 and queens[white] == 0 and rooks[black] == 0 and queens[black] == 0
+        or rooks[white] <= 2 and queens[white] == 0 and queens[black] == 0
+        or rooks[black] <= 2 and queens[black] == 0 and queens[white] == 0
+        or queens[white] == 1 and rooks[white] == 0 and rooks[black] == 0
+        or queens[black] == 1 and rooks[black] == 0
+        or queens[white] <= 1 and queens[black] <= 1 and key == queens[white] * MATERIAL_INCREMENT[white][chess.QUEEN] + queens[black] * MATERIAL_INCREMENT[black][chess.QUEEN]
     ):
-        return True
+        flags |= MATERIAL_ENDGAME
+
+    # Bare kings, or a single minor piece against a bare king
+    if sum(pawns) + sum(rooks) + sum(queens) == 0 and sum(knights) + sum(bishops) <= 1:
+        flags |= MATERIAL_DRAW
+
+    # Giving up the move is only safe when having the move is an advantage, which
+    # stops being true with king and pawns or a lone minor piece left
+    for color, flag in ((white, MATERIAL_ZUGZWANG_WHITE), (black, MATERIAL_ZUGZWANG_BLACK)):
+        pieces = knights[color] + bishops[color] + rooks[color] + queens[color]
+        other_pieces = knights[not color] + bishops[not color] + rooks[not color] + queens[not color]
+        if pieces == 0 or other_pieces and pieces == 1 and rooks[color] + queens[color] == 0:
+            flags |= flag
+
+    return flags
+
+def material_flags(key):
+    flags = material_flags_cache.get(key)
+    if flags is None:
+        flags = material_flags_cache[key] = compute_material_flags(key)
+    return flags
+
+# Move encoding
+# Inside the search a move is an int: from_square | to_square << 6 | flags << 12.
+# Castling is encoded as the king's move to its destination square. The flags
+# give en passant, castling, or the promotion piece (MOVE_PROMOTION plus the
+# piece type minus 2). NULL_MOVE (a1a1) is both the null move and "no move".
+# Moves are turned into chess.Move only for printing and for the UCI board.
+NULL_MOVE = 0
+MOVE_EN_PASSANT = 1 << 12
+MOVE_CASTLING = 2 << 12
+MOVE_PROMOTION = 8 << 12
+MOVE_FLAGS = 15 << 12
+
+# King destination -> rook from and to squares
+CASTLING_ROOK_SQUARES = {
+    chess.G1: (chess.H1, chess.F1),
+    chess.C1: (chess.A1, chess.D1),
+    chess.G8: (chess.H8, chess.F8),
+    chess.C8: (chess.A8, chess.D8),
+}
 
-    # If none of the above conditions are met, return False
-    return False
+def move_promotion(move):
+    return ((move >> 12) - 6) if move & MOVE_PROMOTION else None
+
+def encode_move(board, move):
+    if not move:
+        return NULL_MOVE
+    from_square = move.from_square
+    to_square = move.to_square
+    if move.promotion:
+        return from_square | to_square << 6 | MOVE_PROMOTION | (move.promotion - 2) << 12
+    from_mask = chess.BB_SQUARES[from_square]
+    if board.kings & from_mask and (abs(to_square - from_square) == 2 or board.occupied_co[board.turn] & chess.BB_SQUARES[to_square]):
+        # Castling, given either as king two squares or as king takes rook
+        back_rank = from_square & 56
+        to_square = back_rank + 2 if to_square < from_square else back_rank + 6
+        return from_square | to_square << 6 | MOVE_CASTLING
+    if to_square == board.ep_square and board.pawns & from_mask and (to_square - from_square) & 7:
+        return from_square | to_square << 6 | MOVE_EN_PASSANT
+    return from_square | to_square << 6
+
+def decode_move(move):
+    if not move:
+        return chess.Move.null()
+    return chess.Move(move & 63, move >> 6 & 63, move_promotion(move))
+
+def is_capture(board, move):
+    return bool(board.occupied_co[not board.turn] & chess.BB_SQUARES[move >> 6 & 63]) or move & MOVE_FLAGS == MOVE_EN_PASSANT
+
+# Move generation
+# The generators produce pseudo-legal int moves: everything except leaving or
+# putting the own king in check. Castling is only generated when it is legal.
+# A node computes its checkers and pinned pieces once with check_info, and
+# is_legal then decides a move with a few mask tests, just before it is played.
+PROMOTION_FLAGS = [MOVE_PROMOTION | (piece_type - 2) << 12 for piece_type in (chess.QUEEN, chess.KNIGHT, chess.ROOK, chess.BISHOP)]
+
+# King from square, king to square, the squares that must be empty, the squares that must not be attacked
+CASTLING_PATHS = {
+    chess.H1: (chess.E1, chess.G1, chess.BB_F1 | chess.BB_G1, chess.BB_E1 | chess.BB_F1 | chess.BB_G1),
+    chess.A1: (chess.E1, chess.C1, chess.BB_B1 | chess.BB_C1 | chess.BB_D1, chess.BB_E1 | chess.BB_D1 | chess.BB_C1),
+    chess.H8: (chess.E8, chess.G8, chess.BB_F8 | chess.BB_G8, chess.BB_E8 | chess.BB_F8 | chess.BB_G8),
+    chess.A8: (chess.E8, chess.C8, chess.BB_B8 | chess.BB_C8 | chess.BB_D8, chess.BB_E8 | chess.BB_D8 | chess.BB_C8),
+}
 
-def evaluate_board(board):
+def is_attacked(board, color, square, occupied):
+    return bool(attackers_to(board, square, occupied) & board.occupied_co[color])
 
-    if board.is_checkmate():
-        if board.turn == chess.WHITE:
-            return -10000
+def add_pawn_moves(moves, from_square, to_square, flags=0):
+    if to_square >= 56 or to_square < 8:
+        for promotion in PROMOTION_FLAGS:
+            moves.append(from_square | to_square << 6 | promotion)
+    else:
+        moves.append(from_square | to_square << 6 | flags)
+
+def generate_castling(board, moves, to_mask=chess.BB_ALL):
+    turn = board.turn
+    for rook_square in chess.scan_forward(board.castling_rights & (chess.BB_RANK_1 if turn == chess.WHITE else chess.BB_RANK_8)):
+        king_from, king_to, empty, safe = CASTLING_PATHS[rook_square]
+        if board.occupied & empty or not chess.BB_SQUARES[king_to] & to_mask:
+            continue
+        if any(is_attacked(board, not turn, square, board.occupied) for square in chess.scan_forward(safe)):
+            continue
+        moves.append(king_from | king_to << 6 | MOVE_CASTLING)
+
+def generate_pseudo_legal(board, from_mask=chess.BB_ALL, to_mask=chess.BB_ALL):
+    turn = board.turn
+    own = board.occupied_co[turn]
+    occupied = board.occupied
+    targets = ~own & to_mask
+    moves = []
+
+    for from_square in chess.scan_forward(board.knights & own & from_mask):
+        for to_square in chess.scan_forward(KNIGHT_ATTACKS[from_square] & targets):
+            moves.append(from_square | to_square << 6)
+    for from_square in chess.scan_forward((board.bishops | board.queens) & own & from_mask):
+        for to_square in chess.scan_forward(BISHOP_ATTACKS[from_square][occupied & BISHOP_MASKS[from_square]] & targets):
+            moves.append(from_square | to_square << 6)
+    for from_square in chess.scan_forward((board.rooks | board.queens) & own & from_mask):
+        for to_square in chess.scan_forward(ROOK_ATTACKS[from_square][occupied & ROOK_MASKS[from_square]] & targets):
+            moves.append(from_square | to_square << 6)
+    for from_square in chess.scan_forward(board.kings & own & from_mask):
+        for to_square in chess.scan_forward(KING_ATTACKS[from_square] & targets):
+            moves.append(from_square | to_square << 6)
+        if board.castling_rights & own:
+            generate_castling(board, moves, to_mask)
+
+    pawns = board.pawns & own & from_mask
+    if pawns:
+        enemy = board.occupied_co[not turn] & to_mask
+        pawn_attacks = PAWN_ATTACKS[turn]
+        for from_square in chess.scan_forward(pawns):
+            for to_square in chess.scan_forward(pawn_attacks[from_square] & enemy):
+                add_pawn_moves(moves, from_square, to_square)
+
+        if turn == chess.WHITE:
+            single = pawns << 8 & ~occupied
+            double = (single & chess.BB_RANK_3) << 8 & ~occupied & to_mask
+            step = 8
         else:
-            return 10000
-    if board.can_claim_draw() or board.is_stalemate() or board.is_insufficient_material():
+            single = pawns >> 8 & ~occupied
+            double = (single & chess.BB_RANK_6) >> 8 & ~occupied & to_mask
+            step = -8
+        for to_square in chess.scan_forward(single & to_mask):
+            add_pawn_moves(moves, to_square - step, to_square)
+        for to_square in chess.scan_forward(double):
+            moves.append((to_square - 2 * step) | to_square << 6)
+
+        if board.ep_square is not None and chess.BB_SQUARES[board.ep_square] & to_mask:
+            generate_en_passant(board, moves, pawns)
+
+    return moves
+
+def generate_en_passant(board, moves, pawns):
+    ep_square = board.ep_square
+    for from_square in chess.scan_forward(PAWN_ATTACKS[not board.turn][ep_square] & pawns):
+        moves.append(from_square | ep_square << 6 | MOVE_EN_PASSANT)
+
+def generate_captures(board):
+    # Captures, en passant and capturing promotions
+    moves = generate_pseudo_legal(board, chess.BB_ALL, board.occupied_co[not board.turn])
+    if board.ep_square is not None:
+        generate_en_passant(board, moves, board.pawns & board.occupied_co[board.turn])
+    return moves
+
+def generate_evasions(board, checkers):
+    # With one checker: king moves, captures of the checker and blocks.
+    # With two only the king can move.
+    turn = board.turn
+    king = chess.lsb(board.kings & board.occupied_co[turn])
+    moves = generate_pseudo_legal(board, chess.BB_SQUARES[king], chess.BB_ALL)
+    if checkers & (checkers - 1) == 0:
+        checker = chess.lsb(checkers)
+        moves.extend(generate_pseudo_legal(board, ~chess.BB_SQUARES[king], chess.between(king, checker) | checkers))
+        if board.ep_square is not None and checkers & board.pawns:
+            # The pawn giving check can only be the one that just moved two squares
+            generate_en_passant(board, moves, board.pawns & board.occupied_co[turn])
+    return moves
+
+def check_info(board):
+    # Checkers of the side to move's king and the pieces pinned to it
+    turn = board.turn
+    own = board.occupied_co[turn]
+    enemy = board.occupied_co[not turn]
+    king = chess.lsb(board.kings & own)
+    occupied = board.occupied
+    checkers = attackers_to(board, king, occupied) & enemy
+
+    pinned = 0
+    snipers = ((ROOK_ATTACKS[king][0] & (board.rooks | board.queens))
+               | (BISHOP_ATTACKS[king][0] & (board.bishops | board.queens))) & enemy
+    for sniper in chess.scan_forward(snipers):
+        blockers = chess.between(king, sniper) & occupied
+        if blockers and blockers & (blockers - 1) == 0:
+            pinned |= blockers & own
+    return king, checkers, pinned
+
+def is_legal(board, move, king, checkers, pinned):
+    from_square = move & 63
+    to_square = move >> 6 & 63
+    flags = move & MOVE_FLAGS
+    if flags == MOVE_CASTLING:
+        return not checkers
+    if from_square == king:
+        # The king must not stay on the line of a slider it is moving away from
+        return not is_attacked(board, not board.turn, to_square, board.occupied ^ chess.BB_SQUARES[king])
+    if flags == MOVE_EN_PASSANT:
+        # Two pawns leave the rank at once; simply look at the position after the capture
+        captured_mask = chess.BB_SQUARES[to_square ^ 8]
+        occupied = board.occupied ^ chess.BB_SQUARES[from_square] ^ chess.BB_SQUARES[to_square] ^ captured_mask
+        return not attackers_to(board, king, occupied) & board.occupied_co[not board.turn] & ~captured_mask
+    if checkers:
+        if checkers & (checkers - 1) or not (chess.between(king, chess.lsb(checkers)) | checkers) & chess.BB_SQUARES[to_square]:
+            return False
+    if pinned & chess.BB_SQUARES[from_square]:
+        return bool(chess.ray(king, from_square) & chess.BB_SQUARES[to_square])
+    return True
+
+def is_pseudo_legal(board, move):
+    # For moves that did not come from this node's generator (hash moves, killers)
+    if not move:
+        return False
+    turn = board.turn
+    from_square = move & 63
+    to_square = move >> 6 & 63
+    flags = move & MOVE_FLAGS
+    from_mask = chess.BB_SQUARES[from_square]
+    to_mask = chess.BB_SQUARES[to_square]
+    if not board.occupied_co[turn] & from_mask or board.occupied_co[turn] & to_mask:
+        return False
+    if flags == MOVE_CASTLING:
+        moves = []
+        generate_castling(board, moves)
+        return move in moves
+    if board.pawns & from_mask:
+        if (to_square >= 56 or to_square < 8) != bool(flags & MOVE_PROMOTION):
+            return False
+        if flags == MOVE_EN_PASSANT:
+            return to_square == board.ep_square and bool(PAWN_ATTACKS[turn][from_square] & to_mask)
+        if board.occupied_co[not turn] & to_mask:
+            return bool(PAWN_ATTACKS[turn][from_square] & to_mask)
+        step = 8 if turn == chess.WHITE else -8
+        if to_square == from_square + step:
+            return not board.occupied & to_mask
+        start_rank = chess.BB_RANK_2 if turn == chess.WHITE else chess.BB_RANK_7
+        return (to_square == from_square + 2 * step and bool(from_mask & start_rank)
+                and not board.occupied & (to_mask | chess.BB_SQUARES[from_square + step]))
+    if flags:
+        return False
+    piece_type = board.piece_type_at(from_square)
+    if piece_type == chess.KNIGHT:
+        attacks = KNIGHT_ATTACKS[from_square]
+    elif piece_type == chess.KING:
+        attacks = KING_ATTACKS[from_square]
+    else:
+        attacks = 0
+        if piece_type != chess.ROOK:
+            attacks |= BISHOP_ATTACKS[from_square][board.occupied & BISHOP_MASKS[from_square]]
+        if piece_type != chess.BISHOP:
+            attacks |= ROOK_ATTACKS[from_square][board.occupied & ROOK_MASKS[from_square]]
+    return bool(attacks & to_mask)
+
+def generate_legal_moves(board):
+    king, checkers, pinned = check_info(board)
+    moves = generate_evasions(board, checkers) if checkers else generate_pseudo_legal(board)
+    return [move for move in moves if is_legal(board, move, king, checkers, pinned)]
+
+def has_legal_move(board):
+    king, checkers, pinned = check_info(board)
+    moves = generate_evasions(board, checkers) if checkers else generate_pseudo_legal(board)
+    return any(is_legal(board, move, king, checkers, pinned) for move in moves)
+
+HISTORY_CAPACITY = 1024  # initial size of the history arrays, doubled when full
+
+class SearchBoard(chess.Board):
+    # chess.Board whose moves are a plain make/unmake on the integer
+    # bitboards: no _BoardState is saved and no legality bookkeeping is done,
+    # unmake puts the pieces back from a small undo tuple. Everything that reads
+    # the position (move generation, attacks, fen) is still python-chess; the
+    # board's own _stack stays empty, so use our history arrays, not is_repetition
+    # or root(). The promoted mask is not kept up to date, standard chess does not need it.
+    #
+    # The Zobrist key is kept up to date on push/pop, so the search can read
+    # board.zobrist_key instead of rehashing the position.
+    #
+    # key_history[i] holds the key before the i-th move since the position was set
+    # up, for the game and the current search line alike. rule50 is the halfmove
+    # clock and reversible_plies counts the plies since the last move that no
+    # earlier position can be repeated across (pawn move, capture, castling rights
+    # change or null move); both live in parallel arrays so pop can restore them.
+    # undo_history[i] holds the i-th move (as an int, see encode_move) and the
+    # rest of what unmake_move needs to take it back.
+    #
+    # The search plays int moves with make_move/unmake_move; push/pop take
+    # chess.Move and also keep move_stack, for the game board on the UCI side.
+    #
+    # pst_middlegame and pst_endgame are the running material plus piece-square
+    # totals for white minus black, updated from the pieces each move touches,
+    # and phase is the game phase, which only captures and promotions change.
+    # material_key is the material signature and changes with them too.
+    # pawn_key is the Zobrist key of the pawns alone.
+
+    def __init__(self, fen=chess.STARTING_FEN, *, chess960=False):
+        self.zobrist_key = 0
+        self.pawn_key = 0
+        super().__init__(fen, chess960=chess960)
+
+    @classmethod
+    def from_board(cls, board):
+        if isinstance(board, SearchBoard):
+            return board.copy()
+        search_board = cls(board.root().fen())
+        for move in board.move_stack:
+            search_board.push(move)
+        return search_board
+
+    def clear_stack(self):
+        # Every way of setting up a position (set_fen, reset, clear, ...) ends here
+        super().clear_stack()
+        self.castling_rights = self.clean_castling_rights()
+        self.key_history = [0] * HISTORY_CAPACITY
+        self.rule50_history = [0] * HISTORY_CAPACITY
+        self.reversible_history = [0] * HISTORY_CAPACITY
+        self.undo_history = [None] * HISTORY_CAPACITY
+        self.history_length = 0
+        self.search_root_length = 0
+        self.rule50 = self.halfmove_clock
+        self.reversible_plies = 0
+        self.zobrist_key = chess.polyglot.zobrist_hash(self)
+        self.pawn_key = pawn_zobrist_hash(self)
+        self.pst_middlegame, self.pst_endgame, self.phase = pst_scores(self)
+        self.material_key = material_key(self)
+
+    def copy(self, *, stack=True):
+        board = super().copy(stack=stack)
+        stack = self.history_length if stack is True else min(int(stack), self.history_length)
+        start = self.history_length - stack
+        capacity = max(HISTORY_CAPACITY, stack * 2)
+        board.key_history = self.key_history[start:self.history_length] + [0] * (capacity - stack)
+        board.rule50_history = self.rule50_history[start:self.history_length] + [0] * (capacity - stack)
+        board.reversible_history = self.reversible_history[start:self.history_length] + [0] * (capacity - stack)
+        board.undo_history = self.undo_history[start:self.history_length] + [None] * (capacity - stack)
+        board.history_length = stack
+        board.search_root_length = max(0, self.search_root_length - start)
+        board.rule50 = self.rule50
+        board.reversible_plies = min(self.reversible_plies, stack)
+        board.zobrist_key = self.zobrist_key
+        board.pawn_key = self.pawn_key
+        board.pst_middlegame = self.pst_middlegame
+        board.pst_endgame = self.pst_endgame
+        board.phase = self.phase
+        board.material_key = self.material_key
+        return board
+
+    def castling_key(self):
+        key = 0
+        for mask, value in ZOBRIST_CASTLING:
+            if self.castling_rights & mask:
+                key ^= value
+        return key
+
+    def ep_key(self):
+        ep_square = self.ep_square
+        if ep_square is not None and EP_ATTACKERS[self.turn][ep_square] & self.pawns & self.occupied_co[self.turn]:
+            return ZOBRIST_EP[ep_square & 7]
         return 0
 
-    total_evaluation = 0
-    if not is_endgame_position(board):
-        piece_square_tables = piece_square_tables_middlegame
-        piece_values = piece_values_middlegame
-    else:
-        piece_square_tables = piece_square_tables_endgame
-        piece_values = piece_values_endgame
+    def attackers_mask(self, color, square, occupied=None):
+        # Same as chess.Board.attackers_mask, from our attack tables; python-chess
+        # goes through this for is_check and for the legality of generated moves
+        if occupied is None:
+            occupied = self.occupied
+        if color == chess.WHITE:
+            pawns = PAWN_ATTACKS[chess.BLACK][square] & self.pawns
+        else:
+            pawns = PAWN_ATTACKS[chess.WHITE][square] & self.pawns
+        return ((KNIGHT_ATTACKS[square] & self.knights)
+                | (KING_ATTACKS[square] & self.kings)
+                | pawns
+                | (ROOK_ATTACKS[square][occupied & ROOK_MASKS[square]] & (self.rooks | self.queens))
+                | (BISHOP_ATTACKS[square][occupied & BISHOP_MASKS[square]] & (self.bishops | self.queens))) & self.occupied_co[color]
+
+    def toggle_piece(self, piece_type, color, mask):
+        # Adds the piece if the square is empty, removes it if it is there
+        if piece_type == chess.PAWN:
+            self.pawns ^= mask
+        elif piece_type == chess.KNIGHT:
+            self.knights ^= mask
+        elif piece_type == chess.BISHOP:
+            self.bishops ^= mask
+        elif piece_type == chess.ROOK:
+            self.rooks ^= mask
+        elif piece_type == chess.QUEEN:
+            self.queens ^= mask
+        else:
+            self.kings ^= mask
+        self.occupied ^= mask
+        self.occupied_co[color] ^= mask
+
+    def push(self, move):
+        # python-chess entry point: the game and the UCI side play chess.Move
+        self.make_move(encode_move(self, move))
+        self.move_stack.append(move)
+
+    def pop(self):
+        self.unmake_move()
+        return self.move_stack.pop()
+
+    def last_move(self):
+        n = self.history_length
+        return self.undo_history[n - 1][0] if n else NULL_MOVE
+
+    def make_move(self, move):
+        key = self.zobrist_key
+        n = self.history_length
+        if n == len(self.key_history):
+            self.key_history.extend([0] * n)
+            self.rule50_history.extend([0] * n)
+            self.reversible_history.extend([0] * n)
+            self.undo_history.extend([None] * n)
+        self.key_history[n] = key
+        self.rule50_history[n] = self.rule50
+        self.reversible_history[n] = self.reversible_plies
+        middlegame = self.pst_middlegame
+        endgame = self.pst_endgame
+        phase = self.phase
+        material = self.material_key
+        pawn_key = self.pawn_key
+        turn = self.turn
+        castling_rights = self.castling_rights
+        ep_square = self.ep_square
+        rule50 = self.rule50 + 1
+        reversible_plies = self.reversible_plies + 1
+        piece_type = captured_type = None
+
+        # Take out the castling and en passant parts of the old state
+        key ^= ZOBRIST_TURN ^ self.castling_key() ^ self.ep_key()
+        self.ep_square = None
+
+        if move:
+            from_square = move & 63
+            to_square = move >> 6 & 63
+            flags = move & MOVE_FLAGS
+            from_mask = chess.BB_SQUARES[from_square]
+            to_mask = chess.BB_SQUARES[to_square]
+            pieces = ZOBRIST_PIECES[turn]
+            piece_type = self.piece_type_at(from_square)
+            key ^= pieces[piece_type][from_square]
+            pst_middlegame = PST_MIDDLEGAME[turn]
+            pst_endgame = PST_ENDGAME[turn]
+            middlegame -= pst_middlegame[piece_type][from_square]
+            endgame -= pst_endgame[piece_type][from_square]
+            if piece_type == chess.PAWN:
+                pawn_key ^= pieces[chess.PAWN][from_square]
+
+            # Moving from or to a corner loses that castling right, moving the king both
+            self.castling_rights &= ~from_mask & ~to_mask
+            if piece_type == chess.KING:
+                self.castling_rights &= ~(chess.BB_RANK_1 if turn == chess.WHITE else chess.BB_RANK_8)
+
+            if flags == MOVE_CASTLING:
+                rook_from, rook_to = CASTLING_ROOK_SQUARES[to_square]
+                self.toggle_piece(chess.KING, turn, from_mask | to_mask)
+                self.toggle_piece(chess.ROOK, turn, chess.BB_SQUARES[rook_from] | chess.BB_SQUARES[rook_to])
+                key ^= pieces[chess.KING][to_square] ^ pieces[chess.ROOK][rook_from] ^ pieces[chess.ROOK][rook_to]
+                middlegame += pst_middlegame[chess.KING][to_square] + pst_middlegame[chess.ROOK][rook_to] - pst_middlegame[chess.ROOK][rook_from]
+                endgame += pst_endgame[chess.KING][to_square] + pst_endgame[chess.ROOK][rook_to] - pst_endgame[chess.ROOK][rook_from]
+            else:
+                capture_square = to_square
+                if flags == MOVE_EN_PASSANT:
+                    captured_type = chess.PAWN
+                    capture_square = to_square - 8 if turn == chess.WHITE else to_square + 8
+                else:
+                    captured_type = self.piece_type_at(to_square)
+                if captured_type:
+                    self.toggle_piece(captured_type, not turn, chess.BB_SQUARES[capture_square])
+                    key ^= ZOBRIST_PIECES[not turn][captured_type][capture_square]
+                    middlegame -= PST_MIDDLEGAME[not turn][captured_type][capture_square]
+                    endgame -= PST_ENDGAME[not turn][captured_type][capture_square]
+                    phase -= PHASE_WEIGHTS[captured_type]
+                    material -= MATERIAL_INCREMENT[not turn][captured_type]
+                    if captured_type == chess.PAWN:
+                        pawn_key ^= ZOBRIST_PIECES[not turn][chess.PAWN][capture_square]
+
+                placed_type = move_promotion(move) or piece_type
+                self.toggle_piece(piece_type, turn, from_mask)
+                self.toggle_piece(placed_type, turn, to_mask)
+                phase += PHASE_WEIGHTS[placed_type] - PHASE_WEIGHTS[piece_type]
+                material += MATERIAL_INCREMENT[turn][placed_type] - MATERIAL_INCREMENT[turn][piece_type]
+                key ^= pieces[placed_type][to_square]
+                middlegame += pst_middlegame[placed_type][to_square]
+                endgame += pst_endgame[placed_type][to_square]
+
+                if placed_type == chess.PAWN:
+                    pawn_key ^= pieces[chess.PAWN][to_square]
+                    if abs(to_square - from_square) == 16:
+                        self.ep_square = (from_square + to_square) >> 1
+                if captured_type or piece_type == chess.PAWN:
+                    rule50 = reversible_plies = 0
+        else:
+            # Repetitions are never counted across a null move
+            reversible_plies = 0
+
+        self.undo_history[n] = (move, piece_type, captured_type, castling_rights, ep_square,
+                                self.pst_middlegame, self.pst_endgame, self.phase, self.material_key, self.pawn_key)
+        self.history_length = n + 1
+        self.turn = not turn
+        if turn == chess.BLACK:
+            self.fullmove_number += 1
+
+        if self.castling_rights != castling_rights:
+            reversible_plies = 0
+        self.rule50 = self.halfmove_clock = rule50
+        self.reversible_plies = reversible_plies
+        self.pst_middlegame = middlegame
+        self.pst_endgame = endgame
+        self.phase = phase
+        self.material_key = material
+        self.pawn_key = pawn_key
+
+        # Put back the castling and en passant parts of the new state
+        self.zobrist_key = key ^ self.castling_key() ^ self.ep_key()
+
+        if ZOBRIST_SELF_CHECK:
+            self.check_key()
+        if PST_SELF_CHECK:
+            self.check_pst()
+
+    def unmake_move(self):
+        n = self.history_length - 1
+        self.history_length = n
+        self.zobrist_key = self.key_history[n]
+        self.rule50 = self.halfmove_clock = self.rule50_history[n]
+        self.reversible_plies = self.reversible_history[n]
+        (move, piece_type, captured_type, self.castling_rights, self.ep_square,
+         self.pst_middlegame, self.pst_endgame, self.phase, self.material_key, self.pawn_key) = self.undo_history[n]
+        turn = self.turn = not self.turn
+        if turn == chess.BLACK:
+            self.fullmove_number -= 1
+
+        if move:
+            to_square = move >> 6 & 63
+            from_mask = chess.BB_SQUARES[move & 63]
+            to_mask = chess.BB_SQUARES[to_square]
+            flags = move & MOVE_FLAGS
+            if flags == MOVE_CASTLING:
+                rook_from, rook_to = CASTLING_ROOK_SQUARES[to_square]
+                self.toggle_piece(chess.KING, turn, from_mask | to_mask)
+                self.toggle_piece(chess.ROOK, turn, chess.BB_SQUARES[rook_from] | chess.BB_SQUARES[rook_to])
+            else:
+                self.toggle_piece(move_promotion(move) or piece_type, turn, to_mask)
+                self.toggle_piece(piece_type, turn, from_mask)
+                if flags == MOVE_EN_PASSANT:
+                    self.toggle_piece(chess.PAWN, not turn, chess.BB_SQUARES[to_square - 8 if turn == chess.WHITE else to_square + 8])
+                elif captured_type:
+                    self.toggle_piece(captured_type, not turn, to_mask)
+
+        if ZOBRIST_SELF_CHECK:
+            self.check_key()
+        if PST_SELF_CHECK:
+            self.check_pst()
+
+    def check_key(self):
+        expected = chess.polyglot.zobrist_hash(self)
+        if self.zobrist_key != expected:
+            raise RuntimeError(f"incremental zobrist key {self.zobrist_key:016x} != {expected:016x} in {self.fen()}")
+        expected = pawn_zobrist_hash(self)
+        if self.pawn_key != expected:
+            raise RuntimeError(f"incremental pawn key {self.pawn_key:016x} != {expected:016x} in {self.fen()}")
+
+    def check_pst(self):
+        expected = pst_scores(self) + (material_key(self),)
+        actual = (self.pst_middlegame, self.pst_endgame, self.phase, self.material_key)
+        if actual != expected:
+            raise RuntimeError(f"incremental eval totals {actual} != {expected} in {self.fen()}")
+
+def make_search_board(board):
+    # The search only needs the current position and the keys since the last
+    # irreversible move, so it starts from a copy without the rest of the game.
+    # That keeps the cost of a node independent of how long the game has been.
+    if not isinstance(board, SearchBoard):
+        board = SearchBoard.from_board(board)
+    return board.copy(stack=board.reversible_plies)
+
+# Search scores: being mated at ply p scores -MATE_SCORE + p
+MATE_SCORE = 10000
+MATE_BOUND = 9000  # anything beyond this is a mate score
+
+def score_to_tt(score, ply):
+    # Mate scores are stored relative to the node, not the root
+    if score >= MATE_BOUND:
+        return score + ply
+    if score <= -MATE_BOUND:
+        return score - ply
+    return score
+
+def score_from_tt(score, ply):
+    if score >= MATE_BOUND:
+        return score - ply
+    if score <= -MATE_BOUND:
+        return score + ply
+    return score
+
+def is_material_draw(board):
+    return material_flags(board.material_key) & MATERIAL_DRAW != 0
+
+def is_repetition(board):
+    # Walk back over the positions with the same side to move, stopping at the
+    # last irreversible move. A repetition of a position from inside the search
+    # tree is a draw; one from the game before the root needs a second occurrence.
+    key = board.zobrist_key
+    key_history = board.key_history
+    stop = board.history_length - board.reversible_plies
+    search_root = board.search_root_length
+    seen_before_root = False
+
+    i = board.history_length - 4
+    while i >= stop:
+        if key_history[i] == key:
+            if i >= search_root or seen_before_root:
+                return True
+            seen_before_root = True
+        i -= 2
+    return False
 
-    # Evaluate material
-    for square in chess.SQUARES:
-        piece = board.piece_at(square)
-        if piece is not None:
-            color = board.piece_at(square).color
-            piece_type = board.piece_at(square).piece_type
+# Transposition table
+# Two parallel slots per bucket: slot 0 is depth-preferred, slot 1 is always-replace.
+# Entries live in preallocated flat lists so storing never allocates a new entry.
+TT_EXACT = 0
+TT_LOWER = 1
+TT_UPPER = 2
+
+TT_DEFAULT_MB = 16
+TT_MIN_MB = 1
+TT_MAX_MB = 1024
+TT_SLOT_BYTES = 64  # rough size of one slot across all the lists (key, data and the int objects)
+
+tt_keys = []
+tt_depths = []
+tt_scores = []
+tt_flags = []
+tt_moves = []
+tt_ages = []
+tt_bucket_mask = 0
+tt_age = 0
+
+def tt_resize(megabytes):
+    global tt_keys, tt_depths, tt_scores, tt_flags, tt_moves, tt_ages, tt_bucket_mask
+
+    megabytes = max(TT_MIN_MB, min(TT_MAX_MB, megabytes))
+
+    # Round the bucket count down to a power of two so the index is a simple mask
+    buckets = 1
+    while buckets * 4 * TT_SLOT_BYTES <= megabytes * 1024 * 1024:
+        buckets *= 2
+    slots = buckets * 2
+
+    tt_keys = [-1] * slots
+    tt_depths = [-1] * slots
+    tt_scores = [0] * slots
+    tt_flags = [TT_EXACT] * slots
+    tt_moves = [NULL_MOVE] * slots
+    tt_ages = [0] * slots
+    tt_bucket_mask = buckets - 1
+
+def tt_clear():
+    for i in range(len(tt_keys)):
+        tt_keys[i] = -1
+        tt_depths[i] = -1
+        tt_moves[i] = NULL_MOVE
+
+def tt_new_search():
+    global tt_age
+    tt_age += 1
+
+def tt_probe(key):
+    index = (key & tt_bucket_mask) << 1
+    if tt_keys[index] != key:
+        index += 1
+        if tt_keys[index] != key:
+            return None
+    return tt_depths[index], tt_scores[index], tt_flags[index], tt_moves[index]
+
+def tt_store(key, depth, score, flag, move):
+    index = (key & tt_bucket_mask) << 1
+
+    # The depth-preferred slot only gives way to deeper (or equal) results, or to
+    # anything once its entry is left over from an earlier search
+    if not (tt_keys[index] == key or depth >= tt_depths[index] or tt_ages[index] != tt_age):
+        index += 1
+
+    # Keep the old best move if this result did not produce one
+    if not move and tt_keys[index] == key:
+        move = tt_moves[index]
+
+    tt_keys[index] = key
+    tt_depths[index] = depth
+    tt_scores[index] = score
+    tt_flags[index] = flag
+    tt_moves[index] = move
+    tt_ages[index] = tt_age
+
+tt_resize(TT_DEFAULT_MB)
+
+# Pawn structure
+# Pawn terms only depend on the pawns, so they are computed with whole-board
+# shifts and kept in a table indexed by the pawn key. An entry holds the
+# middlegame and endgame pawn scores (white minus black) and, for each colour, a
+# mask of the files (bit f for file f) without a pawn of that colour.
+PAWN_DOUBLED = (-10, -20)
+PAWN_ISOLATED = (-10, -15)
+PAWN_BACKWARD = (-8, -10)
+PAWN_PASSED_MIDDLEGAME = [0, 5, 10, 15, 25, 40, 60, 0]  # by rank counted from the pawn's own side
+PAWN_PASSED_ENDGAME = [0, 10, 20, 35, 60, 100, 150, 0]
+
+ROOK_OPEN_FILE = 25
+ROOK_HALF_OPEN_FILE = 12
+QUEEN_OPEN_FILE = 8
+QUEEN_HALF_OPEN_FILE = 4
+KING_SHELTER_HALF_OPEN_FILE = -15  # middlegame, per file next to the king without a pawn of its side
+KING_SHELTER_OPEN_FILE = -10  # on top of that when the file has no pawns at all
+
+PAWN_HASH_BITS = 14
+
+pawn_hash_keys = [-1] * (1 << PAWN_HASH_BITS)
+pawn_hash_entries = [None] * (1 << PAWN_HASH_BITS)
+
+def north_fill(bb):
+    bb |= (bb << 8) & chess.BB_ALL
+    bb |= (bb << 16) & chess.BB_ALL
+    bb |= (bb << 32) & chess.BB_ALL
+    return bb
+
+def south_fill(bb):
+    bb |= bb >> 8
+    bb |= bb >> 16
+    bb |= bb >> 32
+    return bb
+
+def sideways(bb):
+    return ((bb << 1) & ~chess.BB_FILE_A & chess.BB_ALL) | ((bb >> 1) & ~chess.BB_FILE_H)
+
+def pawn_terms(pawns, front, files, stops, attack_span, enemy_front, enemy_attacks):
+    # front: squares ahead of these pawns on their own files; attack span: the
+    # squares they attack now or after advancing; stops: the squares just ahead
+    doubled = chess.popcount(pawns & front)
+    isolated = chess.popcount(pawns & ~sideways(files))
+    backward = chess.popcount(stops & enemy_attacks & ~attack_span)
+    passed = pawns & ~(enemy_front | sideways(enemy_front))
+    middlegame = doubled * PAWN_DOUBLED[0] + isolated * PAWN_ISOLATED[0] + backward * PAWN_BACKWARD[0]
+    endgame = doubled * PAWN_DOUBLED[1] + isolated * PAWN_ISOLATED[1] + backward * PAWN_BACKWARD[1]
+    return middlegame, endgame, passed
+
+def pawn_structure(white_pawns, black_pawns):
+    white_stops = white_pawns << 8 & chess.BB_ALL
+    black_stops = black_pawns >> 8
+    white_front = north_fill(white_stops)
+    black_front = south_fill(black_stops)
+    white_files = south_fill(north_fill(white_pawns))
+    black_files = south_fill(north_fill(black_pawns))
+    white_attacks = sideways(white_stops)
+    black_attacks = sideways(black_stops)
+
+    white_middlegame, white_endgame, white_passed = pawn_terms(
+        white_pawns, white_front, white_files, white_stops, north_fill(white_attacks), black_front, black_attacks)
+    black_middlegame, black_endgame, black_passed = pawn_terms(
+        black_pawns, black_front, black_files, black_stops, south_fill(black_attacks), white_front, white_attacks)
+    middlegame = white_middlegame - black_middlegame
+    endgame = white_endgame - black_endgame
+    for square in chess.scan_forward(white_passed):
+        middlegame += PAWN_PASSED_MIDDLEGAME[square >> 3]
+        endgame += PAWN_PASSED_ENDGAME[square >> 3]
+    for square in chess.scan_forward(black_passed):
+        middlegame -= PAWN_PASSED_MIDDLEGAME[7 - (square >> 3)]
+        endgame -= PAWN_PASSED_ENDGAME[7 - (square >> 3)]
+
+    white_empty_files = ~(white_files >> 56) & 0xff
+    black_empty_files = ~(black_files >> 56) & 0xff
+    return middlegame, endgame, (black_empty_files, white_empty_files)
+
+def probe_pawn_structure(board):
+    key = board.pawn_key
+    index = key & ((1 << PAWN_HASH_BITS) - 1)
+    if pawn_hash_keys[index] == key:
+        return pawn_hash_entries[index]
+    entry = pawn_structure(board.pawns & board.occupied_co[chess.WHITE], board.pawns & board.occupied_co[chess.BLACK])
+    pawn_hash_keys[index] = key
+    pawn_hash_entries[index] = entry
+    return entry
+
+def pawn_hash_clear():
+    for i in range(len(pawn_hash_keys)):
+        pawn_hash_keys[i] = -1
+        pawn_hash_entries[i] = None
+
+def file_terms(board, empty_files):
+    # Rooks and queens on open and half-open files and open files next to the
+    # kings, read off the cached pawn file masks (middlegame only)
+    open_files = empty_files[chess.WHITE] & empty_files[chess.BLACK]
+    score = 0
+    for color, sign in ((chess.WHITE, 1), (chess.BLACK, -1)):
+        own_empty = empty_files[color]
+        for square in chess.scan_forward(board.rooks & board.occupied_co[color]):
+            file_bit = 1 << (square & 7)
+            if open_files & file_bit:
+                score += sign * ROOK_OPEN_FILE
+            elif own_empty & file_bit:
+                score += sign * ROOK_HALF_OPEN_FILE
+        for square in chess.scan_forward(board.queens & board.occupied_co[color]):
+            file_bit = 1 << (square & 7)
+            if open_files & file_bit:
+                score += sign * QUEEN_OPEN_FILE
+            elif own_empty & file_bit:
+                score += sign * QUEEN_HALF_OPEN_FILE
+
+        king_file = board.king(color) & 7
+        shelter_files = (0b111 << king_file >> 1) & 0xff
+        score += sign * (chess.popcount(shelter_files & own_empty) * KING_SHELTER_HALF_OPEN_FILE
+                         + chess.popcount(shelter_files & open_files) * KING_SHELTER_OPEN_FILE)
+    return score
 
-            if color == chess.WHITE:
-                square_value = piece_square_tables[piece_type][63 - square]
-            else:
-                square_value = piece_square_tables[piece_type][square]
+def is_endgame_position(board):
+    return material_flags(board.material_key) & MATERIAL_ENDGAME != 0
+
+# Endgame recognizers
+# endgame_recognizers maps a material signature to (evaluate, scale, search_depth,
+# strong_side). evaluate(board, strong_side) replaces the whole evaluation,
+# scale(board, strong_side) returns a factor out of SCALE_NORMAL for the normal
+# one, and search_depth overrides calculateMaxDepth. Any of them may be None.
+SCALE_NORMAL = 64
+KNOWN_WIN = 500
+
+endgame_recognizers = {}
+
+def register_endgame(strong_pieces, weak_pieces, evaluate=None, scale=None, search_depth=None):
+    # Registers the ending for either side being the strong one
+    endgame_recognizers[material_signature(strong_pieces, weak_pieces)] = (evaluate, scale, search_depth, chess.WHITE)
+    endgame_recognizers[material_signature(weak_pieces, strong_pieces)] = (evaluate, scale, search_depth, chess.BLACK)
+
+def evaluate_mop_up(board, strong_side, corner_distance):
+    # Won ending without pawns: drive the weak king towards the edge (or the
+    # corner given by corner_distance) and bring the strong king closer
+    weak_king = board.king(not strong_side)
+    strong_king = board.king(strong_side)
+
+    score = KNOWN_WIN + (board.pst_endgame if strong_side == chess.WHITE else -board.pst_endgame)
+    score += ENDGAME_OPP_KING_CORNERED_TABLE[weak_king]
+    score += 20 * (7 - corner_distance(weak_king))
+    score += 10 * (7 - chess.square_distance(strong_king, weak_king))
+    return score if strong_side == chess.WHITE else -score
+
+def evaluate_kxk(board, strong_side):
+    return evaluate_mop_up(board, strong_side, lambda square: min(
+        chess.square_file(square), 7 - chess.square_file(square), chess.square_rank(square), 7 - chess.square_rank(square)))
+
+def evaluate_kbnk(board, strong_side):
+    # Only the two corners of the bishop's colour can be mated in
+    if board.bishops & chess.BB_LIGHT_SQUARES:
+        corners = (chess.A8, chess.H1)
+    else:
+        corners = (chess.A1, chess.H8)
+    return evaluate_mop_up(board, strong_side, lambda square: min(chess.square_distance(square, corner) for corner in corners))
+
+def scale_draw(board, strong_side):
+    return 0
+
+def scale_kpk(board, strong_side):
+    pawn = chess.lsb(board.pawns)
+    pawn_file = chess.square_file(pawn)
+    weak_king = board.king(not strong_side)
+    strong_king = board.king(strong_side)
+    if strong_side == chess.WHITE:
+        promotion_square = chess.square(pawn_file, 7)
+        pawn_distance = min(5, 7 - chess.square_rank(pawn))
+        def ahead(square):
+            return chess.square_rank(square) > chess.square_rank(pawn)
+    else:
+        promotion_square = chess.square(pawn_file, 0)
+        pawn_distance = min(5, chess.square_rank(pawn))
+        def ahead(square):
+            return chess.square_rank(square) < chess.square_rank(pawn)
+
+    # Rule of the square: the defending king cannot catch the pawn
+    king_distance = chess.square_distance(weak_king, promotion_square) - (board.turn != strong_side)
+    if king_distance > pawn_distance:
+        return SCALE_NORMAL
+
+    # A rook pawn cannot be promoted against a king in the corner
+    if pawn_file in (0, 7) and chess.square_distance(weak_king, promotion_square) <= 1:
+        return 0
+
+    # A king in front of the pawn holds unless the other king gets there first
+    if ahead(weak_king) and abs(chess.square_file(weak_king) - pawn_file) <= 1 and not ahead(strong_king):
+        return SCALE_NORMAL // 8
+    return SCALE_NORMAL
+
+def scale_opposite_bishops(board, strong_side):
+    if chess.popcount(board.bishops & chess.BB_LIGHT_SQUARES) != 1:
+        return SCALE_NORMAL
+    pawn_difference = abs(chess.popcount(board.pawns & board.occupied_co[chess.WHITE]) - chess.popcount(board.pawns & board.occupied_co[chess.BLACK]))
+    return SCALE_NORMAL // 4 if pawn_difference <= 1 else SCALE_NORMAL // 2
+
+register_endgame("R", "", evaluate=evaluate_kxk, search_depth=5)
+register_endgame("Q", "", evaluate=evaluate_kxk)
+register_endgame("BN", "", evaluate=evaluate_kbnk)
+register_endgame("NN", "", scale=scale_draw)
+register_endgame("P", "", scale=scale_kpk)
+for _white_pawns in range(9):
+    for _black_pawns in range(9):
+        endgame_recognizers[material_signature("B" + "P" * _white_pawns, "B" + "P" * _black_pawns)] = (None, scale_opposite_bishops, None, chess.WHITE)
 
-            total_evaluation += piece_values[piece_type] if color == chess.WHITE else -piece_values[piece_type]
-            total_evaluation += square_value if color == chess.WHITE else -square_value
+def evaluate_board(board):
+    # Static evaluation only: mates and draws are found by the search
+    recognizer = endgame_recognizers.get(board.material_key)
+    if recognizer is not None and recognizer[0] is not None:
+        return recognizer[0](board, recognizer[3])
+
+    # Material and piece-square tables come from the board's running totals,
+    # blended by the game phase together with the pawn structure and file terms
+    pawn_middlegame, pawn_endgame, empty_files = probe_pawn_structure(board)
+    middlegame = board.pst_middlegame + pawn_middlegame + file_terms(board, empty_files)
+    endgame = board.pst_endgame + pawn_endgame
+    phase = min(board.phase, MAX_PHASE)
+    total_evaluation = (middlegame * phase + endgame * (MAX_PHASE - phase)) // MAX_PHASE
 
     if is_endgame_position(board):
 
         # bonus for negating the opponent's king mobility
         opponent_king_square = board.king(chess.BLACK if board.turn == chess.WHITE else chess.WHITE)
-        opponent_king_mobility = len(board.attackers(chess.WHITE, opponent_king_square) | board.attackers(chess.BLACK, opponent_king_square))
+        opponent_king_mobility = chess.popcount(attackers_to(board, opponent_king_square, board.occupied) & board.occupied)
         total_evaluation -= 35 * opponent_king_mobility  # You can adjust the bonus value
 
         # King proximity bonus
@@ -263,138 +1303,556 @@ def evaluate_board(board):
 
         total_evaluation +=  ENDGAME_OPP_KING_CORNERED_TABLE[opponent_king_square]
 
-    return total_evaluation
-
-def is_king_and_rook_endgame(board):
-    # Check for 1 rook, kings, and no other pieces
-    if (
-        sum(1 for _ in board.pieces(chess.QUEEN, chess.WHITE)) == 0
-        and sum(1 for _ in board.pieces(chess.KING, chess.WHITE)) == 1
-        and sum(1 for _ in board.pieces(chess.KNIGHT, chess.WHITE)) == 0
-        and sum(1 for _ in board.pieces(chess.BISHOP, chess.WHITE)) == 0
-        and sum(1 for _ in board.pieces(chess.ROOK, chess.WHITE)) == 1
-        and sum(1 for _ in board.pieces(chess.PAWN, chess.WHITE)) == 0
-        and sum(1 for _ in board.pieces(chess.QUEEN, chess.BLACK)) == 0
-        and sum(1 for _ in board.pieces(chess.KING, chess.BLACK)) == 1
-        and sum(1 for _ in board.pieces(chess.KNIGHT, chess.BLACK)) == 0
-        and sum(1 for _ in board.pieces(chess.BISHOP, chess.BLACK)) == 0
-        and sum(1 for _ in board.pieces(chess.ROOK, chess.BLACK)) == 0
-        and sum(1 for _ in board.pieces(chess.PAWN, chess.BLACK)) == 0
-    ):
-        return True
-
-    # Check for 1 rook, kings, and no other pieces
-    if (
-        sum(1 for _ in board.pieces(chess.QUEEN, chess.WHITE)) == 0
-        and sum(1 for _ in board.pieces(chess.KING, chess.WHITE)) == 1
-        and sum(1 for _ in board.pieces(chess.KNIGHT, chess.WHITE)) == 0
-        and sum(1 for _ in board.pieces(chess.BISHOP, chess.WHITE)) == 0
-        and sum(1 for _ in board.pieces(chess.ROOK, chess.WHITE)) == 0
-        and sum(1 for _ in board.pieces(chess.PAWN, chess.WHITE)) == 0
-        and sum(1 for _ in board.pieces(chess.QUEEN, chess.BLACK)) == 0
-        and sum(1 for _ in board.pieces(chess.KING, chess.BLACK)) == 1
-        and sum(1 for _ in board.pieces(chess.KNIGHT, chess.BLACK)) == 0
-        and sum(1 for _ in board.pieces(chess.BISHOP, chess.BLACK)) == 0
-        and sum(1 for _ in board.pieces(chess.ROOK, chess.BLACK)) == 1
-        and sum(1 for _ in board.pieces(chess.PAWN, chess.BLACK)) == 0
-    ):
-        return True
-
-    return False
+    if recognizer is not None and recognizer[1] is not None:
+        total_evaluation = total_evaluation * recognizer[1](board, recognizer[3]) // SCALE_NORMAL
 
-def is_king_and_queen_endgame(board):
-    # Check for 1 rook, kings, and no other pieces
-    if (
-        sum(1 for _ in board.pieces(chess.QUEEN, chess.WHITE)) == 1
-        and sum(1 for _ in board.pieces(chess.KING, chess.WHITE)) == 1
-        and sum(1 for _ in board.pieces(chess.KNIGHT, chess.WHITE)) == 0
-        and sum(1 for _ in board.pieces(chess.BISHOP, chess.WHITE)) == 0
-        and sum(1 for _ in board.pieces(chess.ROOK, chess.WHITE)) == 0
-        and sum(1 for _ in board.pieces(chess.PAWN, chess.WHITE)) == 0
-        and sum(1 for _ in board.pieces(chess.QUEEN, chess.BLACK)) == 0
-        and sum(1 for _ in board.pieces(chess.KING, chess.BLACK)) == 1
-        and sum(1 for _ in board.pieces(chess.KNIGHT, chess.BLACK)) == 0
-        and sum(1 for _ in board.pieces(chess.BISHOP, chess.BLACK)) == 0
-        and sum(1 for _ in board.pieces(chess.ROOK, chess.BLACK)) == 0
-        and sum(1 for _ in board.pieces(chess.PAWN, chess.BLACK)) == 0
-    ):
-        return True
+    return total_evaluation
 
-    # Check for 1 rook, kings, and no other pieces
-    if (
-        sum(1 for _ in board.pieces(chess.QUEEN, chess.WHITE)) == 0
-        and sum(1 for _ in board.pieces(chess.KING, chess.WHITE)) == 1
-        and sum(1 for _ in board.pieces(chess.KNIGHT, chess.WHITE)) == 0
-        and sum(1 for _ in board.pieces(chess.BISHOP, chess.WHITE)) == 0
-        and sum(1 for _ in board.pieces(chess.ROOK, chess.WHITE)) == 0
-        and sum(1 for _ in board.pieces(chess.PAWN, chess.WHITE)) == 0
-        and sum(1 for _ in board.pieces(chess.QUEEN, chess.BLACK)) == 1
-        and sum(1 for _ in board.pieces(chess.KING, chess.BLACK)) == 0
-        and sum(1 for _ in board.pieces(chess.KNIGHT, chess.BLACK)) == 0
-        and sum(1 for _ in board.pieces(chess.BISHOP, chess.BLACK)) == 0
-        and sum(1 for _ in board.pieces(chess.ROOK, chess.BLACK)) == 1
-        and sum(1 for _ in board.pieces(chess.PAWN, chess.BLACK)) == 0
-    ):
-        return True
+# Evaluation cache
+# Static evaluations by Zobrist key, in buckets of EVAL_CACHE_WAYS slots. A hit
+# marks its slot as referenced; a store walks the bucket with a clock hand,
+# clearing reference marks, and takes the first slot that was not referenced.
+EVAL_CACHE_DEFAULT_MB = 4
+EVAL_CACHE_MIN_MB = 1
+EVAL_CACHE_MAX_MB = 256
+EVAL_CACHE_WAYS = 4
+EVAL_CACHE_SLOT_BYTES = 48  # rough size of one slot across the lists
+
+eval_cache_keys = []
+eval_cache_scores = []
+eval_cache_referenced = []
+eval_cache_hands = []
+eval_cache_bucket_mask = 0
+eval_cache_hits = 0
+eval_cache_misses = 0
+
+def eval_cache_resize(megabytes):
+    global eval_cache_keys, eval_cache_scores, eval_cache_referenced, eval_cache_hands, eval_cache_bucket_mask
+
+    megabytes = max(EVAL_CACHE_MIN_MB, min(EVAL_CACHE_MAX_MB, megabytes))
+
+    buckets = 1
+    while buckets * 2 * EVAL_CACHE_WAYS * EVAL_CACHE_SLOT_BYTES <= megabytes * 1024 * 1024:
+        buckets *= 2
+    slots = buckets * EVAL_CACHE_WAYS
+
+    eval_cache_keys = [-1] * slots
+    eval_cache_scores = [0] * slots
+    eval_cache_referenced = [False] * slots
+    eval_cache_hands = [0] * buckets
+    eval_cache_bucket_mask = buckets - 1
+
+def eval_cache_clear():
+    for i in range(len(eval_cache_keys)):
+        eval_cache_keys[i] = -1
+        eval_cache_referenced[i] = False
+
+def eval_cache_reset_stats():
+    global eval_cache_hits, eval_cache_misses
+    eval_cache_hits = 0
+    eval_cache_misses = 0
+
+def evaluate_cached(board):
+    global eval_cache_hits, eval_cache_misses
+    key = board.zobrist_key
+    bucket = key & eval_cache_bucket_mask
+    base = bucket * EVAL_CACHE_WAYS
+    for index in range(base, base + EVAL_CACHE_WAYS):
+        if eval_cache_keys[index] == key:
+            eval_cache_hits += 1
+            eval_cache_referenced[index] = True
+            return eval_cache_scores[index]
+
+    eval_cache_misses += 1
+    score = evaluate_board(board)
+
+    # Give referenced slots a second chance; after one sweep the hand is
+    # back where it started and that slot is taken
+    hand = eval_cache_hands[bucket]
+    for _ in range(EVAL_CACHE_WAYS):
+        if not eval_cache_referenced[base + hand]:
+            break
+        eval_cache_referenced[base + hand] = False
+        hand = (hand + 1) % EVAL_CACHE_WAYS
+    index = base + hand
+    eval_cache_hands[bucket] = (hand + 1) % EVAL_CACHE_WAYS
+
+    eval_cache_keys[index] = key
+    eval_cache_scores[index] = score
+    eval_cache_referenced[index] = False
+    return score
+
+eval_cache_resize(EVAL_CACHE_DEFAULT_MB)
+
+# Search deadline
+# The search polls the clock every TIME_CHECK_INTERVAL nodes and, once the hard
+# deadline has passed, sets search_stopped and unwinds without trusting any score.
+TIME_CHECK_INTERVAL = 1024
+
+search_deadline = float('inf')
+search_stopped = False
+time_check_countdown = TIME_CHECK_INTERVAL
+
+def start_search_clock(deadline):
+    global search_deadline, search_stopped, time_check_countdown
+    search_deadline = deadline
+    search_stopped = False
+    time_check_countdown = TIME_CHECK_INTERVAL
+
+def poll_search_clock():
+    global search_stopped, time_check_countdown
+    time_check_countdown = TIME_CHECK_INTERVAL
+    if time.time() >= search_deadline:
+        search_stopped = True
+
+def quiescence(board, alpha, beta, color, depth, ply=0):
+    global time_check_countdown
+    time_check_countdown -= 1
+    if time_check_countdown <= 0:
+        poll_search_clock()
+    if search_stopped:
+        return 0
 
-    return False
+    if is_material_draw(board):
+        return 0
 
+    king, checkers, pinned = check_info(board)
+    in_check = checkers != 0
+    if depth == 0:
+        if in_check and not has_legal_move(board):
+            return -MATE_SCORE + ply
+        return color * evaluate_cached(board)
 
+    if in_check:
+        # No standing pat in check: every evasion is searched, and having none is mate
+        moves = generate_evasions(board, checkers)
+    else:
+        stand_pat = color * evaluate_cached(board)
+        if stand_pat >= beta:
+            return beta
+        if alpha < stand_pat:
+            alpha = stand_pat
 
-def quiescence(board, alpha, beta, color, depth):
-    if depth == 0 or board.is_game_over():
-        return color * evaluate_board(board)
+        moves = sorted(generate_captures(board), key=lambda move: mvv_lva(board, move), reverse=True)
 
-    stand_pat = color * evaluate_board(board)
-    if stand_pat >= beta:
-        return beta
-    if alpha < stand_pat:
-        alpha = stand_pat
+    moves_searched = 0
+    for move in moves:
+        # Captures that lose material cannot raise the stand-pat score
+        if not in_check and not see_ge(board, move, 0):
+            continue
+        if not is_legal(board, move, king, checkers, pinned):
+            continue
 
-    legal_captures = [move for move in board.legal_moves if board.is_capture(move)]
+        moves_searched += 1
+        board.make_move(move)
+        score = -quiescence(board, -beta, -alpha, -color, depth - 1, ply + 1)
+        board.unmake_move()
 
-    for move in legal_captures:
-        board.push(move)
-        score = -quiescence(board, -beta, -alpha, -color, depth - 1)
-        board.pop()
+        if search_stopped:
+            return 0
 
         if score >= beta:
             return beta
         if score > alpha:
             alpha = score
 
+    if in_check and moves_searched == 0:
+        return -MATE_SCORE + ply
     return alpha
 
-def negamax_alpha_beta(board, depth, alpha, beta, color, nodes):
-    if depth == 0 or board.is_game_over():
-        return quiescence(board, alpha, beta, color, 2), nodes
+# Move ordering
+MAX_PLY = 64
+
+killer_moves = [[NULL_MOVE, NULL_MOVE] for _ in range(MAX_PLY)]
+
+# Butterfly history: history_table[side][move & 4095], the from and to squares
+history_table = [[0] * 4096 for _ in chess.COLORS]
+
+# Triangular PV: row p of pv_table (MAX_PLY entries from p * MAX_PLY) holds the
+# best line found from ply p on, in pv_table[p * MAX_PLY + p:p * MAX_PLY + pv_length[p]]
+pv_table = [NULL_MOVE] * (MAX_PLY * MAX_PLY)
+pv_length = [0] * MAX_PLY
+
+def update_pv(ply, move):
+    # A new best move at ply: it heads the row, followed by the child's line
+    row = ply * MAX_PLY
+    pv_table[row + ply] = move
+    end = ply + 1
+    if end < MAX_PLY:
+        child_end = pv_length[end]
+        pv_table[row + end:row + child_end] = pv_table[row + MAX_PLY + end:row + MAX_PLY + child_end]
+        end = max(end, child_end)
+    pv_length[ply] = end
+
+def principal_variation():
+    return pv_table[:pv_length[0]]
+
+def mvv_lva(board, move):
+    victim = board.piece_type_at(move >> 6 & 63)
+    aggressor = board.piece_type_at(move & 63)
+
+    if victim is None:
+        victim = chess.PAWN  # en passant
+    if aggressor is not None:
+        return piece_values_endgame[victim] - piece_values_middlegame[aggressor]
+    return 0
+
+def clear_move_ordering():
+    for table in history_table:
+        for i in range(4096):
+            table[i] = 0
+    for killers in killer_moves:
+        killers[0] = killers[1] = NULL_MOVE
+
+def age_move_ordering():
+    # Keep the history of the previous search, but let the new one outweigh it
+    for table in history_table:
+        for i in range(4096):
+            table[i] >>= 1
+    for killers in killer_moves:
+        killers[0] = killers[1] = NULL_MOVE
+
+def update_move_ordering(board, move, depth, ply):
+    killers = killer_moves[ply]
+    if killers[0] != move:
+        killers[1] = killers[0]
+        killers[0] = move
+    history_table[board.turn][move & 4095] += depth * depth
+
+# Static exchange evaluation
+see_piece_values = [0, 100, 325, 325, 500, 900, 20000]
+
+def least_valuable_attacker(board, attackers):
+    for piece_type in chess.PIECE_TYPES:
+        bb = attackers & board.pieces_mask(piece_type, chess.WHITE) | attackers & board.pieces_mask(piece_type, chess.BLACK)
+        if bb:
+            return piece_type, bb & -bb
+    return None, 0
+
+def see_pins(board, color, to_square):
+    # (pinned piece, pinner) pairs for color's pieces pinned to their king on a
+    # line that does not go through to_square: they cannot recapture there
+    king_mask = board.kings & board.occupied_co[color]
+    if not king_mask:
+        return []
+    king = chess.lsb(king_mask)
+    snipers = ((ROOK_ATTACKS[king][0] & (board.rooks | board.queens))
+               | (BISHOP_ATTACKS[king][0] & (board.bishops | board.queens))) & board.occupied_co[not color]
+    pins = []
+    for sniper in chess.scan_forward(snipers):
+        blockers = chess.between(king, sniper) & board.occupied
+        if blockers & board.occupied_co[color] and blockers & (blockers - 1) == 0:
+            if not chess.ray(king, sniper) & chess.BB_SQUARES[to_square]:
+                pins.append((blockers, chess.BB_SQUARES[sniper]))
+    return pins
+
+def see(board, move):
+    # Material won or lost by the capture sequence on the target square, with both
+    # sides always recapturing with their least valuable piece. Attackers are
+    # recomputed against the shrinking occupancy, so x-ray attackers behind the
+    # captured pieces join in. A piece pinned to its king stays out of the
+    # exchange for as long as its pinner is still on the board.
+    from_square = move & 63
+    to_square = move >> 6 & 63
+    occupied = board.occupied ^ chess.BB_SQUARES[from_square]
+
+    victim = board.piece_type_at(to_square)
+    if move & MOVE_FLAGS == MOVE_EN_PASSANT:
+        victim = chess.PAWN
+        occupied ^= chess.BB_SQUARES[to_square - 8 if board.turn == chess.WHITE else to_square + 8]
+
+    gain = [see_piece_values[victim] if victim else 0]
+    on_square = see_piece_values[board.piece_type_at(from_square)]
+    promotion = move_promotion(move)
+    if promotion:
+        gain[0] += see_piece_values[promotion] - see_piece_values[chess.PAWN]
+        on_square = see_piece_values[promotion]
+
+    side = not board.turn
+    attackers = attackers_to(board, to_square, occupied) & occupied
+    pins = [see_pins(board, chess.BLACK, to_square), see_pins(board, chess.WHITE, to_square)]
 
-    legal_moves = list(board.legal_moves)
+    while True:
+        side_attackers = attackers & board.occupied_co[side]
+        for pinned, pinner in pins[side]:
+            if pinner & occupied:
+                side_attackers &= ~pinned
+        if not side_attackers:
+            break
+        piece_type, bb = least_valuable_attacker(board, side_attackers)
 
-    for move in legal_moves:
-        board.push(move)
+        # The king may only recapture when nothing covers the square any more
+        if piece_type == chess.KING and attackers & board.occupied_co[not side]:
+            break
+
+        gain.append(on_square - gain[-1])
+        on_square = see_piece_values[piece_type]
+        occupied ^= bb
+        attackers = attackers_to(board, to_square, occupied) & occupied
+        side = not side
+
+    # Either side may stop capturing whenever continuing would lose material
+    while len(gain) > 1:
+        last = gain.pop()
+        gain[-1] = -max(-gain[-1], last)
+    return gain[0]
+
+def see_ge(board, move, threshold=0):
+    # Does the capture win at least threshold? Most captures are decided from the
+    # two pieces involved without playing out the exchange
+    victim = board.piece_type_at(move >> 6 & 63)
+    victim_value = see_piece_values[victim] if victim else see_piece_values[chess.PAWN] if move & MOVE_FLAGS == MOVE_EN_PASSANT else 0
+    if move & MOVE_PROMOTION:
+        return see(board, move) >= threshold
+    if victim_value < threshold:
+        return False
+    if victim_value - see_piece_values[board.piece_type_at(move & 63)] >= threshold:
+        return True
+    return see(board, move) >= threshold
+
+def pick_moves(board, hash_move, ply, king, checkers, pinned):
+    # Staged move picker: hash move, winning captures and promotions by MVV-LVA,
+    # killers, quiet moves by history, then the captures that lose material. A stage is only generated once the previous one
+    # is used up, so a node that cuts off early never builds the later ones.
+    # The board is back in this node's position whenever the picker resumes.
+    # Moves are generated pseudo-legal and checked against the node's pins and
+    # checkers (from check_info) only when they are about to be returned.
+    if hash_move and is_pseudo_legal(board, hash_move) and is_legal(board, hash_move, king, checkers, pinned):
+        yield hash_move
+
+    history = history_table[board.turn]
+
+    if checkers:
+        # In check: the evasions only, captures of the checker first
+        evasions = generate_evasions(board, checkers)
+        evasions.sort(key=lambda move: (is_capture(board, move), mvv_lva(board, move), history[move & 4095]), reverse=True)
+        for move in evasions:
+            if move != hash_move and is_legal(board, move, king, checkers, pinned):
+                yield move
+        return
+
+    promotion_pawns = board.pawns & board.occupied_co[board.turn] & (chess.BB_RANK_7 if board.turn == chess.WHITE else chess.BB_RANK_2)
+    tactical_moves = generate_captures(board)
+    if promotion_pawns:
+        tactical_moves.extend(generate_pseudo_legal(board, promotion_pawns, ~board.occupied))
+    tactical_moves.sort(key=lambda move: mvv_lva(board, move), reverse=True)
+    bad_captures = []
+    for move in tactical_moves:
+        if move != hash_move:
+            if move & MOVE_PROMOTION or see_ge(board, move, 0):
+                if is_legal(board, move, king, checkers, pinned):
+                    yield move
+            else:
+                bad_captures.append(move)
+
+    killers = killer_moves[ply] if ply < MAX_PLY else (NULL_MOVE, NULL_MOVE)
+    for killer in killers:
+        if (killer and killer != hash_move and not killer & MOVE_PROMOTION and not is_capture(board, killer)
+                and is_pseudo_legal(board, killer) and is_legal(board, killer, king, checkers, pinned)):
+            yield killer
+
+    quiet_moves = [
+        move for move in generate_pseudo_legal(board, ~promotion_pawns, ~board.occupied_co[not board.turn])
+        if move != hash_move and move not in killers and move & MOVE_FLAGS != MOVE_EN_PASSANT
+    ]
+    quiet_moves.sort(key=lambda move: history[move & 4095], reverse=True)
+    for move in quiet_moves:
+        if is_legal(board, move, king, checkers, pinned):
+            yield move
+
+    for move in bad_captures:
+        if is_legal(board, move, king, checkers, pinned):
+            yield move
+
+# Null-move pruning
+NULL_MOVE_MIN_DEPTH = 2
+NULL_MOVE_VERIFICATION_DEPTH = 8  # verify null-move cutoffs from this depth on
+
+# Null moves are not tried before this ply while a verification search is running
+nmp_min_ply = 0
+
+def is_zugzwang_prone(board):
+    flag = MATERIAL_ZUGZWANG_WHITE if board.turn == chess.WHITE else MATERIAL_ZUGZWANG_BLACK
+    return material_flags(board.material_key) & flag != 0
+
+# Late move reductions: LMR_TABLE[depth][move_number], both capped at 63
+LMR_MIN_DEPTH = 3
+LMR_MIN_MOVES = 3  # the hash move, the best captures and killers come first and are never reduced
+
+LMR_TABLE = [[0] * 64 for _ in range(64)]
+for _depth in range(1, 64):
+    for _move_number in range(1, 64):
+        LMR_TABLE[_depth][_move_number] = int(0.75 + math.log(_depth) * math.log(_move_number) / 2.25)
+
+def negamax_alpha_beta(board, depth, alpha, beta, color, nodes, ply=1):
+    global time_check_countdown, nmp_min_ply
+    # Lines that end here, by a cutoff, a draw or the horizon, add nothing to the PV
+    if ply < MAX_PLY:
+        pv_length[ply] = ply
+    time_check_countdown -= 1
+    if time_check_countdown <= 0:
+        poll_search_clock()
+    if search_stopped:
+        return 0, nodes
+
+    # Draws by rule end the line without looking at the moves
+    if board.rule50 >= 100 or is_material_draw(board) or is_repetition(board):
+        return 0, nodes
+
+    if depth <= 0:
+        return quiescence(board, alpha, beta, color, 2, ply), nodes
+
+    # PV nodes are searched with an open window; everything else only has to
+    # prove a bound, so pruning is restricted to non-PV nodes
+    pv_node = beta - alpha > 1
+
+    key = board.zobrist_key
+    alpha_orig = alpha
+    hash_move = NULL_MOVE
+
+    entry = tt_probe(key)
+    if entry is not None:
+        tt_depth, tt_score, tt_flag, hash_move = entry
+        tt_score = score_from_tt(tt_score, ply)
+        if tt_depth >= depth:
+            if tt_flag == TT_EXACT:
+                return tt_score, nodes
+            if not pv_node and tt_flag == TT_LOWER and tt_score >= beta:
+                return tt_score, nodes
+            if not pv_node and tt_flag == TT_UPPER and tt_score <= alpha:
+                return tt_score, nodes
+
+    king, checkers, pinned = check_info(board)
+    in_check = checkers != 0
+
+    # Null-move pruning: if passing still fails high, a real move will too
+    if (not pv_node and depth >= NULL_MOVE_MIN_DEPTH and ply >= nmp_min_ply
+            and board.last_move() != NULL_MOVE
+            and not in_check and not is_zugzwang_prone(board)):
+        reduction = 3 if depth >= 6 else 2
+        board.make_move(NULL_MOVE)
         nodes += 1
-        value, nodes = negamax_alpha_beta(board, depth - 1, -beta, -alpha, -color, nodes)
+        value, nodes = negamax_alpha_beta(board, depth - 1 - reduction, -beta, -beta + 1, -color, nodes, ply + 1)
         value = -value
-        board.pop()
-        alpha = max(alpha, value)
+        board.unmake_move()
+
+        if search_stopped:
+            return 0, nodes
+
+        if value >= beta:
+            if value >= MATE_BOUND:
+                value = beta
+
+            if depth < NULL_MOVE_VERIFICATION_DEPTH:
+                return value, nodes
+
+            # Deep cutoffs are verified by a reduced search without null moves
+            # for the first part of the subtree. A verification search nested in
+            # another one must not lift the outer one's ban when it is done.
+            previous_min_ply = nmp_min_ply
+            nmp_min_ply = max(nmp_min_ply, ply + 3 * (depth - reduction) // 4)
+            verified, nodes = negamax_alpha_beta(board, depth - reduction, beta - 1, beta, color, nodes, ply)
+            nmp_min_ply = previous_min_ply
+
+            if search_stopped:
+                return 0, nodes
+            if verified >= beta:
+                return value, nodes
+
+    killers = killer_moves[ply] if ply < MAX_PLY else (NULL_MOVE, NULL_MOVE)
+    history = history_table[board.turn]
+
+    best_move = NULL_MOVE
+    moves_searched = 0
+    for move in pick_moves(board, hash_move, ply, king, checkers, pinned):
+        quiet = not move & MOVE_PROMOTION and not is_capture(board, move)
+        board.make_move(move)
+        nodes += 1
+        if moves_searched == 0:
+            value, nodes = negamax_alpha_beta(board, depth - 1, -beta, -alpha, -color, nodes, ply + 1)
+            value = -value
+        else:
+            # Late quiet moves are first searched to a reduced depth; moves with a
+            # history of cutoffs, killers and PV nodes get reduced less
+            reduction = 0
+            if depth >= LMR_MIN_DEPTH and moves_searched >= LMR_MIN_MOVES and quiet and not in_check and not board.is_check():
+                reduction = LMR_TABLE[min(depth, 63)][min(moves_searched, 63)]
+                if pv_node:
+                    reduction -= 1
+                if move in killers or history[move & 4095] > 0:
+                    reduction -= 1
+                reduction = max(0, min(reduction, depth - 2))
+
+            # Principal variation search: a zero window proves the move is no better,
+            # only a fail high inside the window needs the full re-search
+            value, nodes = negamax_alpha_beta(board, depth - 1 - reduction, -alpha - 1, -alpha, -color, nodes, ply + 1)
+            value = -value
+            if reduction and value > alpha and not search_stopped:
+                value, nodes = negamax_alpha_beta(board, depth - 1, -alpha - 1, -alpha, -color, nodes, ply + 1)
+                value = -value
+            if alpha < value < beta and not search_stopped:
+                value, nodes = negamax_alpha_beta(board, depth - 1, -beta, -alpha, -color, nodes, ply + 1)
+                value = -value
+        board.unmake_move()
+        moves_searched += 1
+
+        if search_stopped:
+            return 0, nodes
+
+        if value > alpha:
+            alpha = value
+            best_move = move
+            if ply < MAX_PLY:
+                update_pv(ply, move)
         if alpha >= beta:
+            if ply < MAX_PLY and quiet:
+                update_move_ordering(board, move, depth, ply)
             break
 
-    if is_king_and_queen_endgame(board) or is_king_and_rook_endgame(board):
-        if alpha < beta:
-            score = quiescence(board, alpha, beta, color, 2)
-            alpha = max(alpha, score)
+    # No legal moves: checkmate or stalemate
+    if moves_searched == 0:
+        return (-MATE_SCORE + ply if in_check else 0), nodes
+
+    if alpha >= beta:
+        tt_store(key, depth, score_to_tt(alpha, ply), TT_LOWER, best_move)
+    elif alpha > alpha_orig:
+        tt_store(key, depth, score_to_tt(alpha, ply), TT_EXACT, best_move)
+    else:
+        tt_store(key, depth, score_to_tt(alpha, ply), TT_UPPER, NULL_MOVE)
 
     return alpha, nodes
 
-def get_best_move(board, depth):
+# Root move statistics from the previous iteration: move -> (score, subtree nodes)
+root_stats_key = None
+root_move_stats = {}
+root_best_move = NULL_MOVE
+
+def order_root_moves(board, legal_moves):
+    # Previous best move first, then the other moves by their previous score,
+    # with the subtree size breaking ties between moves that failed low
+    if board.zobrist_key != root_stats_key or not root_move_stats:
+        return legal_moves
+
+    def root_move_key(move):
+        score, subtree_nodes = root_move_stats.get(move, (float('-inf'), 0))
+        return (move == root_best_move, score, subtree_nodes)
+
+    return sorted(legal_moves, key=root_move_key, reverse=True)
+
+def get_best_move(board, depth, alpha=float('-inf'), beta=float('inf')):
+    global root_stats_key, root_move_stats, root_best_move
+
+    if not isinstance(board, SearchBoard):
+        board = SearchBoard.from_board(board)
+
+    board.search_root_length = board.history_length
+    pv_length[0] = 0
+
     nodes = 0
-    best_move = None
+    best_move = NULL_MOVE
     best_value = float('-inf')
-    alpha = float('-inf')
-    beta = float('inf')
-    legal_moves = list(board.legal_moves)
+    alpha_orig = alpha
+    legal_moves = generate_legal_moves(board)
 
     if board.turn == chess.WHITE:
       color = 1
@@ -402,30 +1860,120 @@ def get_best_move(board, depth):
       color = -1
 
     for move in legal_moves:
-        board.push(move)
+        board.make_move(move)
         nodes += 1
-        if board.is_checkmate():
-            board.pop()
-            return move, 10000, nodes
+        if board.is_check() and not has_legal_move(board):
+            board.unmake_move()
+            pv_length[1] = 1
+            update_pv(0, move)
+            return move, MATE_SCORE - 1, nodes
         else: 
             nodes = 0
-            board.pop()
+            board.unmake_move()
 
+    # Search the best move of the previous iteration first
+    key = board.zobrist_key
+    if key == root_stats_key and root_move_stats:
+        legal_moves = order_root_moves(board, legal_moves)
+    else:
+        entry = tt_probe(key)
+        if entry is not None:
+            hash_move = entry[3]
+            if hash_move and hash_move in legal_moves:
+                legal_moves.remove(hash_move)
+                legal_moves.insert(0, hash_move)
+
+    move_stats = {}
     for move in legal_moves:
-        board.push(move)
+        board.make_move(move)
         nodes += 1
-        value, nodes = negamax_alpha_beta(board, depth - 1, -beta, -alpha, -color, nodes)
-        value = -value
-        board.pop()
+        nodes_before = nodes
+        if not best_move:
+            value, nodes = negamax_alpha_beta(board, depth - 1, -beta, -alpha, -color, nodes, 1)
+            value = -value
+        else:
+            value, nodes = negamax_alpha_beta(board, depth - 1, -alpha - 1, -alpha, -color, nodes, 1)
+            value = -value
+            if alpha < value < beta and not search_stopped:
+                value, nodes = negamax_alpha_beta(board, depth - 1, -beta, -alpha, -color, nodes, 1)
+                value = -value
+        board.unmake_move()
+
+        # Out of time: the moves searched so far (the previous best first) still
+        # give a usable result, this one does not
+        if search_stopped:
+            return best_move, best_value, nodes
+
+        move_stats[move] = (value, nodes - nodes_before)
 
         if value > best_value:
             best_value = value
             best_move = move
+            update_pv(0, move)
 
         alpha = max(alpha, value)
+        if alpha >= beta:
+            break
+
+    if best_value <= alpha_orig:
+        # Failed low: nothing was proven about the moves, keep last iteration's order
+        tt_store(key, depth, best_value, TT_UPPER, NULL_MOVE)
+    elif best_move:
+        tt_store(key, depth, best_value, TT_LOWER if best_value >= beta else TT_EXACT, best_move)
+
+        root_stats_key = key
+        root_move_stats = move_stats
+        root_best_move = best_move
 
     return best_move, best_value, nodes
+
+# Aspiration windows
+ASPIRATION_MIN_DEPTH = 2
+ASPIRATION_WINDOW = 40
+ASPIRATION_MAX_RESEARCHES = 3  # after this many failures, search with the full window
+
+def aspiration_search(board, depth, previous_score):
+    # Search a narrow window around the previous iteration's score and widen it on
+    # the failing side until the score falls inside.
+    # Returns (best_move, score, nodes, (alpha, beta), researches).
+    if depth < ASPIRATION_MIN_DEPTH or previous_score is None or abs(previous_score) >= MATE_BOUND:
+        best_move, score, nodes = get_best_move(board, depth)
+        return best_move, score, nodes, (float('-inf'), float('inf')), 0
+
+    delta = ASPIRATION_WINDOW
+    alpha = previous_score - delta
+    beta = previous_score + delta
+    total_nodes = 0
+    researches = 0
+
+    while True:
+        best_move, score, nodes = get_best_move(board, depth, alpha, beta)
+        total_nodes += nodes
+
+        if search_stopped or alpha < score < beta:
+            return best_move, score, total_nodes, (alpha, beta), researches
+
+        researches += 1
+        delta *= 2
+        if researches >= ASPIRATION_MAX_RESEARCHES:
+            alpha = float('-inf')
+            beta = float('inf')
+        elif score <= alpha:
+            alpha = score - delta
+        else:
+            beta = score + delta
     
+def reset_search_state():
+    # Forget everything learned from earlier searches (ucinewgame, bench)
+    global root_stats_key, root_move_stats, root_best_move
+    tt_clear()
+    eval_cache_clear()
+    pawn_hash_clear()
+    clear_move_ordering()
+    root_stats_key = None
+    root_move_stats = {}
+    root_best_move = NULL_MOVE
+
 def calculateMaxTime(board, remaining_time):
     if board.fullmove_number < 15:
         return remaining_time / 60
@@ -434,10 +1982,240 @@ def calculateMaxTime(board, remaining_time):
     else:
         return remaining_time / 50
 
+def calculateHardTime(board, remaining_time):
+    # Allow an iteration to overrun the soft limit, but never by enough to flag
+    return min(calculateMaxTime(board, remaining_time) * 4, remaining_time / 10)
+
+# Iterative deepening normally runs until the time budget is used up; this
+# only keeps the search plies inside the killer table
+MAX_SEARCH_DEPTH = MAX_PLY - 1
+
 def calculateMaxDepth(board):
-    if is_king_and_rook_endgame(board):
-        return 5
-    return 3
+    recognizer = endgame_recognizers.get(board.material_key)
+    if recognizer is not None and recognizer[2] is not None:
+        return recognizer[2]
+    return MAX_SEARCH_DEPTH
+
+# Benchmark: the last position of a 300-ply game, searched once with the whole
+# game behind it and once set up from the FEN 20 plies before the end. The game
+# has pawn moves and captures all the way through and ends with 89 reversible
+# plies (no position played three times, inside the 50-move rule), so the long
+# run has to replay a long move list and scan a long run of repetition keys.
+# Both runs search the same tree, so they must report the same node count and
+# the cost of a node should not depend on how long the game has gone on.
+BENCH_GAME = """
+    e2e4 e7e5 g1f3 b8c6 f1b5 a7a6 b5a4 g8f6 e1g1 f8e7 f1e1 b7b5 a4b3 d7d6 c2c3 e8g8 h2h3 c6a5 b3c2 c7c5
+    d2d3 a8b8 c1e3 c5c4 b1d2 c8d7 a1c1 d7e6 d1e2 h7h6 c1d1 f8e8 d3d4 a5c6 a2a4 b8c8 a4b5 c6a5 e2f1 d8c7
+    h3h4 f6g4 f1e2 e8d8 h4h5 c8b8 e1f1 e7f6 d4d5 e6d7 g2g3 b8b7 d1e1 a6b5 f3h2 c7c8 d2f3 c8c7 e1a1 b5b4
+    a1c1 b4b3 c2d1 d7c8 e3d2 d8f8 e2e1 f8e8 d1e2 c8d7 h2g4 f6e7 f3h4 c7d8 h4f3 b7a7 f3g5 a7b7 d2e3 d8a8
+    c1a1 f7f5 g1g2 d7b5 a1d1 f5f4 e3c5 h6g5 c5a3 e7f8 e2f3 b7d7 a3b4 d7d8 g2g1 a5b7 e1e2 g8h7 h5h6 h7h8
+    d1e1 f8e7 e2d2 h8g8 b4a3 g7h6 e1d1 g8g7 f1e1 e7f8 d2e2 a8a5 a3b4 a5c7 e2d2 h6h5 g4h2 c7f7 g3g4 b7c5
+    f3g2 f7g6 b4c5 h5h4 c5e3 d8b8 d2e2 h4h3 e3c1 g6h6 h2f3 b8d8 e2f1 h3h2 g1h1 f8e7 f3g1 e7f6 g2f3 h2g1r
+    h1g1 d8d7 c1d2 h6h4 f1g2 g7h8 g2f1 d7e7 f1g2 h8g7 e1f1 e8c8 d1e1 g7h8 e1c1 h4h6 f1d1 f6g7 d2f4 e7f7
+    g2h2 h8h7 d1f1 c8h8 f1d1 f7f6 f4d2 b5d7 d1e1 d7b5 c1d1 h8e8 d2e3 e8h8 h2h5 f6f3 h5h2 h7g6 h2h5 g6h7
+    h5h2 h6h4 h2g2 h4h3 e3b6 h8a8 b6c7 g7f8 e1e2 a8c8 c7b6 f3d3 g2h3 h7g7 e2e1 f8e7 h3h6 g7f7 h6g7 f7e8
+    g7f8 e8d7 f8h8 d3g3 g1h2 g3g2 h2h3 g2g3 h3h2 c8h8 h2g3 b5a4 d1c1 h8h6 b6e3 h6g6 c1d1 d7c7 g3g2 c7b7
+    g2f3 e7d8 e1e2 b7c7 d1a1 g6h6 a1f1 d8f6 e2d2 f6d8 f1e1 h6h4 e1c1 a4e8 e3a7 h4h8 f3e3 h8g8 c1h1 d8f6
+    h1h2 e8b5 e3e2 c7b7 h2h3 b5d7 h3h6 g8c8 e2e3 c8g8 h6h2 g8e8 d2e2 b7c8 h2h6 f6e7 h6g6 e8h8 a7b6 d7a4
+    b6a5 c8d7 e2e1 d7e8 e3f3 h8h2 a5b6 h2h7 e1d1 a4b5 d1d2 e8f8 f3g3 b5a4 g6e6 a4d7 g3f3 h7h1 e6g6 h1g1
+    d2e2 d7e8 f3e3 e8b5 e3f3 g1a1 f3g2 a1d1 g2f3 d1h1 b6a5 h1h2 g6e6 h2h7 e2e1 f8e8 e6g6 h7h2 a5b6 e7f8
+""".split()
+BENCH_SHORT_PLIES = 20
+BENCH_DEPTH = 8
+
+def bench_board(fen_ply):
+    # Play the first fen_ply moves, set the board up from the FEN reached and
+    # play the rest of the game on top of it
+    board = SearchBoard()
+    for move in BENCH_GAME[:fen_ply]:
+        board.push_uci(move)
+    board = SearchBoard(board.fen())
+    for move in BENCH_GAME[fen_ply:]:
+        board.push_uci(move)
+    return board
+
+def bench():
+    node_counts = []
+    for fen_ply in (len(BENCH_GAME) - BENCH_SHORT_PLIES, 0):
+        board = bench_board(fen_ply)
+
+        reset_search_state()
+        start_search_clock(float('inf'))
+        start_time = time.time()
+
+        search_board = make_search_board(board)
+        nodes = 0
+        for depth in range(1, BENCH_DEPTH + 1):
+            nodes += get_best_move(search_board, depth)[2]
+
+        elapsed_time = time.time() - start_time
+        node_counts.append(nodes)
+        print(f"info string bench ply {len(board.move_stack)} reversible {board.reversible_plies} depth {BENCH_DEPTH} nodes {nodes} time {int(elapsed_time * 1000)} nps {int(nodes / elapsed_time)}")
+
+    if node_counts[0] != node_counts[1]:
+        print(f"info string bench node counts differ: {node_counts[0]} and {node_counts[1]}")
+        return False
+    return True
+
+# Exchange cases with known values: fen, capture, expected see()
+SEE_CASES = [
+    ("4r1k1/8/8/4p3/8/8/4R3/6K1 w - - 0 1", "e2e5", -400),  # rook takes a defended pawn
+    ("4r1k1/8/8/4p3/8/8/4R3/4Q1K1 w - - 0 1", "e2e5", 100),  # the queen behind the rook recaptures (x-ray)
+    ("1k1r4/1pp4p/p7/4p3/8/P5P1/1PP4P/2K1R3 w - - 0 1", "e1e5", 100),  # undefended pawn
+    ("4k3/8/8/3pP3/8/8/8/4K3 w - d6 0 1", "e5d6", 100),  # en passant
+    ("4k3/2p5/8/3pP3/8/8/8/4K3 w - d6 0 1", "e5d6", 0),  # en passant, recaptured
+    ("r3k3/1P6/8/8/8/8/8/4K3 w - - 0 1", "b7a8q", 1300),  # capture with promotion
+    ("r3k3/1Pn5/8/8/8/8/8/4K3 w - - 0 1", "b7a8q", 400),  # the new queen is taken back
+    ("7k/8/5n2/3p4/8/8/8/3RK3 w - - 0 1", "d1d5", -400),  # knight defends the pawn
+    ("7k/8/5n2/3p4/8/2B5/8/3RK3 w - - 0 1", "d1d5", 100),  # the defending knight is pinned to its king
+]
+
+def bench_see():
+    failures = 0
+    for fen, uci_move, expected in SEE_CASES:
+        board = SearchBoard(fen)
+        value = see(board, encode_move(board, chess.Move.from_uci(uci_move)))
+        if value != expected:
+            failures += 1
+            print(f"info string see {fen} {uci_move} expected {expected} got {value}")
+    print(f"info string bench see cases {len(SEE_CASES)} failures {failures}")
+    return failures == 0
+
+# Positions for the move generation checks: the start position and the usual
+# perft test positions (castling, en passant, promotions, pins and checks)
+CHECK_FENS = [
+    chess.STARTING_FEN,
+    "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+    "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1",
+    "r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1",
+    "rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8",
+]
+MAKEUNMAKE_GAMES = 200
+MAKEUNMAKE_PLIES = 120
+
+def incremental_state(board):
+    return (board.fen(), board.zobrist_key, board.pawn_key, board.pst_middlegame, board.pst_endgame, board.phase, board.material_key)
+
+def bench_makeunmake():
+    # Random push/pop sequences (with the odd null move): after every step the
+    # incrementally updated keys and scores must match a board set up from the
+    # FEN, and every pop must give back exactly the state before the push
+    rng = random.Random(1)
+    failures = 0
+    steps = 0
+    for game in range(MAKEUNMAKE_GAMES):
+        board = SearchBoard(CHECK_FENS[game % len(CHECK_FENS)])
+        states = [incremental_state(board)]
+        for _ in range(rng.randint(1, MAKEUNMAKE_PLIES)):
+            moves = generate_legal_moves(board)
+            if board.move_stack and (not moves or rng.random() < 0.3):
+                board.pop()
+                states.pop()
+                state = incremental_state(board)
+                expected = states[-1]
+            else:
+                if not moves:
+                    break
+                if rng.random() < 0.05 and not check_info(board)[1]:
+                    board.push(chess.Move.null())
+                else:
+                    board.push(decode_move(rng.choice(moves)))
+                state = incremental_state(board)
+                # Keep the en passant square even when the capture is illegal:
+                # polyglot hashes it whenever a pawn stands next to the pusher
+                expected = incremental_state(SearchBoard(board.fen(en_passant="fen")))
+                states.append(state)
+            steps += 1
+            if state != expected:
+                failures += 1
+                print(f"info string makeunmake {state[0]} after {' '.join(move.uci() for move in board.move_stack)}")
+                print(f"info string makeunmake expected {expected} got {state}")
+                break
+        while board.move_stack:
+            board.pop()
+        if incremental_state(board) != states[0]:
+            failures += 1
+            print(f"info string makeunmake {states[0][0]} not restored after taking every move back")
+    print(f"info string bench makeunmake games {MAKEUNMAKE_GAMES} steps {steps} failures {failures}")
+    return failures == 0
+
+# Perft positions: fen, depth, known node count (None: only cross-checked)
+PERFT_CASES = [
+    (CHECK_FENS[0], 3, 8902),
+    (CHECK_FENS[1], 3, 97862),
+    (CHECK_FENS[2], 4, 43238),
+    (CHECK_FENS[3], 3, 9467),
+    (CHECK_FENS[4], 3, 62379),
+    ("3k4/3p4/8/K1P4r/8/8/8/8 b - - 0 1", 4, None),  # d7d5: cxd6 e.p. would expose the king on the rank
+    ("8/8/4k3/8/2p5/8/B2P2K1/8 w - - 0 1", 4, None),  # d2d4: cxd3 e.p. is pinned by the bishop
+    ("8/8/1k6/2b5/2pP4/8/5K2/8 b - d3 0 1", 4, None),  # en passant that gives check
+    ("r3k2r/1b4bq/8/8/8/8/7B/R3K2R w KQkq - 0 1", 3, None),  # castling through attacked squares
+    ("r3k2r/8/3Q4/8/8/5q2/8/R3K2R b KQkq - 0 1", 3, None),  # castling out of and into check
+    ("5k2/8/8/8/8/8/8/4K2R w K - 0 1", 4, None),  # castling that gives check
+    ("4k3/8/5N2/8/8/8/8/4R1K1 b - - 0 1", 4, None),  # double check, only the king can move
+    ("2K2r2/4P3/8/8/8/8/8/3k4 w - - 0 1", 4, None),  # promote out of check
+]
+
+def perft_check(board, reference, depth, mismatches):
+    # Perft with our generator, checking every node against python-chess on a
+    # plain chess.Board: the legal moves, the captures and, in check, that the
+    # evasions are exactly the legal moves the full generator finds
+    moves = generate_legal_moves(board)
+    legal = set(reference.legal_moves)
+    king, checkers, pinned = check_info(board)
+    captures = [move for move in generate_captures(board) if is_legal(board, move, king, checkers, pinned)]
+    problems = []
+    if len(moves) != len(legal) or {decode_move(move) for move in moves} != legal:
+        problems.append("legal moves")
+    if len(captures) != len(set(captures)) or {decode_move(move) for move in captures} != {move for move in legal if reference.is_capture(move)}:
+        problems.append("captures")
+    if checkers:
+        evasions = [move for move in generate_evasions(board, checkers) if is_legal(board, move, king, checkers, pinned)]
+        full = [move for move in generate_pseudo_legal(board) if is_legal(board, move, king, checkers, pinned)]
+        if len(evasions) != len(full) or set(evasions) != set(full):
+            problems.append("evasions")
+    if problems:
+        mismatches.append((reference.fen(), problems))
+
+    if depth <= 1:
+        return len(legal)
+    nodes = 0
+    for move in moves:
+        board.make_move(move)
+        reference.push(decode_move(move))
+        nodes += perft_check(board, reference, depth - 1, mismatches)
+        reference.pop()
+        board.unmake_move()
+    return nodes
+
+def bench_perft():
+    failures = 0
+    for fen, depth, expected in PERFT_CASES:
+        mismatches = []
+        nodes = perft_check(SearchBoard(fen), chess.Board(fen), depth, mismatches)
+        for mismatch_fen, problems in mismatches[:5]:
+            print(f"info string perft {mismatch_fen} differs from python-chess: {', '.join(problems)}")
+        if mismatches or (expected is not None and nodes != expected):
+            failures += 1
+        print(f"info string perft {fen} depth {depth} nodes {nodes}" + (f" expected {expected}" if expected is not None else ""))
+    print(f"info string bench perft positions {len(PERFT_CASES)} failures {failures}")
+    return failures == 0
+
+# bench sub-modes: "bench <mode>" on the UCI side or "python ofishv1k.py bench <mode>"
+BENCH_MODES = {
+    "see": bench_see,
+    "makeunmake": bench_makeunmake,
+    "perft": bench_perft,
+}
+
+def bench_command(arguments):
+    if not arguments:
+        return bench()
+    mode = BENCH_MODES.get(arguments[0])
+    if mode is None:
+        print(f"info string unknown bench mode {arguments[0]}, modes: {' '.join(BENCH_MODES)}")
+        return False
+    return mode()
 
 def uci():
     print("id name Ofish1")
@@ -446,7 +2224,12 @@ def uci():
 
 
 def main():
-    board = chess.Board()
+    board = SearchBoard()
+
+    # The position the board is currently set to, so that the next "position"
+    # command only has to play the moves that were added since
+    position_base = chess.STARTING_FEN
+    position_moves = []
 
     uci_mode = False
     wtime = 1000000
@@ -459,28 +2242,59 @@ def main():
             print("id name OfishV1K")
             print("id author Chess123easy")
             # Include any additional information about your engine
+            print(f"option name Hash type spin default {TT_DEFAULT_MB} min {TT_MIN_MB} max {TT_MAX_MB}")
+            print(f"option name EvalCache type spin default {EVAL_CACHE_DEFAULT_MB} min {EVAL_CACHE_MIN_MB} max {EVAL_CACHE_MAX_MB}")
             print("uciok")
             uci_mode = True
         elif input_line == "isready":
             print("readyok")
+        elif input_line == "ucinewgame":
+            reset_search_state()
+        elif input_line.split()[:1] == ["bench"]:
+            bench_command(input_line.split()[1:])
+        elif input_line.startswith("setoption"):
+            parts = input_line.split()
+            if "name" in parts and "value" in parts:
+                name = " ".join(parts[parts.index("name") + 1:parts.index("value")])
+                value = " ".join(parts[parts.index("value") + 1:])
+                if name.lower() == "hash":
+                    tt_resize(int(value))
+                elif name.lower() == "evalcache":
+                    eval_cache_resize(int(value))
         elif input_line.startswith("position"):
             parts = input_line.split()
             if len(parts) < 2:
                 continue
             position_type = parts[1]
             if position_type == "startpos":
-                board.set_fen(chess.STARTING_FEN)
-                if len(parts) > 2 and parts[2] == "moves":
-                    for move in parts[3:]:
-                        board.push_uci(move)
+                base = chess.STARTING_FEN
+                moves = parts[3:] if len(parts) > 2 and parts[2] == "moves" else []
             elif position_type == "fen":
                 if len(parts) < 8:
                     continue
-                fen = " ".join(parts[2:8])
-                board.set_fen(fen)
-                if len(parts) > 8 and parts[8] == "moves":
-                    for move in parts[9:]:
-                        board.push_uci(move)
+                base = " ".join(parts[2:8])
+                moves = parts[9:] if len(parts) > 8 and parts[8] == "moves" else []
+            else:
+                continue
+
+            # Usually the new move list just extends the current one: keep the
+            # board (and its key history) and only play the new moves. Take back
+            # moves that differ, and set the board up again only for a new base.
+            common = 0
+            if base == position_base:
+                limit = min(len(moves), len(position_moves))
+                while common < limit and moves[common] == position_moves[common]:
+                    common += 1
+                for _ in range(len(position_moves) - common):
+                    board.pop()
+            else:
+                board.set_fen(base)
+
+            position_base = base
+            position_moves = position_moves[:common]
+            for move in moves[common:]:
+                board.push_uci(move)
+                position_moves.append(move)
             position_fen = board.fen()
 
         elif input_line.startswith("go"):
@@ -504,31 +2318,67 @@ def main():
 
            remainingtime = wtime / 1000 if board.turn == chess.WHITE else btime / 1000
 
+           if max_time > 0:
+               soft_time = hard_time = max_time / 1000
+           else:
+               soft_time = calculateMaxTime(board, remainingtime)
+               hard_time = calculateHardTime(board, remainingtime)
+
            start_time = time.time()  # Start the timer
+           start_search_clock(start_time + hard_time)
+           tt_new_search()
+           age_move_ordering()
+           eval_cache_reset_stats()
+
+           search_board = make_search_board(board)
 
+           best_move = NULL_MOVE
+           score = None
            depth = 1  # Start with depth 1
+           depth_limit = calculateMaxDepth(board)
+           if max_depth > 0:
+               depth_limit = min(depth_limit, max_depth)
 
            # Inside the while loop in uci_loop function
-           while depth <= calculateMaxDepth(board):
-                best_move, score, nodes = get_best_move(board, depth)
+           while depth <= depth_limit:
+                move, score, nodes, window, researches = aspiration_search(search_board, depth, score)
+
+                # Hit the hard limit mid-iteration: keep the partial result only if
+                # it searched at least the previous best move to the new depth
+                if search_stopped:
+                    if move:
+                        best_move = move
+                    break
+
+                best_move = move
+                pv = " ".join(decode_move(move).uci() for move in principal_variation())
+                print(f"info depth {depth} score cp {score} nodes {nodes} pv {pv}")
+                print(f"info string aspiration window {window[0]} {window[1]} researches {researches}")
+                print(f"info string eval cache hits {eval_cache_hits} misses {eval_cache_misses}")
 
-                # Check if the maximum time has been exceeded
+                # Do not start another iteration once the soft limit has passed
                 elapsed_time = time.time() - start_time
-                if elapsed_time > calculateMaxTime(board, remainingtime):
+                if elapsed_time > soft_time:
                     break
 
-                print(f"info depth {depth} score cp {score} nodes {nodes} pv {best_move}")
+                # Once a mate for us is found, searching deeper only finds it again
+                if score >= MATE_BOUND:
+                    break
 
                 # Increase the search depth for the next iteration
                 depth += 1
 
+           if not best_move:
+               best_move = encode_move(board, next(iter(board.legal_moves)))
 
            # Output the final result
-           print("bestmove", best_move.uci())
+           print("bestmove", decode_move(best_move).uci())
 
         elif input_line == "quit":
             break
 
 
 if __name__ == "__main__":
+    if sys.argv[1:2] == ["bench"]:
+        sys.exit(0 if bench_command(sys.argv[2:]) else 1)
     main()
\ No newline at end of file